@@ -0,0 +1,15 @@
+"""A dummy stdio MCP server exposing an `echo` tool, for benchmarks."""
+
+from fastmcp import FastMCP
+
+mcp = FastMCP("bench")
+
+
+@mcp.tool
+def echo(text: str) -> str:
+    """Return the given text unchanged."""
+    return text
+
+
+if __name__ == "__main__":
+    mcp.run()
@@ -0,0 +1,135 @@
+"""A local stand-in for a streaming OpenAI-compatible chat-completions endpoint.
+
+Answers every request with `tokens` words streamed at `tps` words per second
+after `ttft` seconds, followed by a usage chunk. A user message containing
+"tool" is answered with a call to the `echo` tool instead, and json requests
+get a small JSON object, so compaction works too.
+
+    python benchmarks/fake_openai.py [port]
+"""
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAI:
+    def __init__(self, tokens: int = 200, tps: float = 0, ttft: float = 0):
+        self.tokens = tokens
+        self.tps = tps
+        self.ttft = ttft
+        self.requests = 0
+        self.server = None
+
+    def start(self, port: int = 0) -> str:
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self.server.daemon_threads = True
+        # handlers reach this instance through self.server
+        self.server.fake = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def chunks(self, request: dict):
+        self.requests += 1
+        messages = request["messages"]
+        last = messages[-1]
+        prompt_tokens = sum(len(str(m.get("content") or "").split()) for m in messages)
+        wants_tool = last["role"] == "user" and "tool" in str(last["content"])
+
+        if request.get("tools") and wants_tool:
+            args = json.dumps({"text": str(last["content"])[:64]})
+            yield (
+                {
+                    "tool_calls": [
+                        {
+                            "index": 0,
+                            "id": f"call_{self.requests}",
+                            "type": "function",
+                            "function": {"name": "echo", "arguments": args},
+                        }
+                    ]
+                },
+                1,
+            )
+            completion = 1
+        elif request.get("response_format", {}).get("type") == "json_object":
+            yield {"content": json.dumps({"Q&A": [], "resources": []})}, 1
+            completion = 1
+        else:
+            for i in range(self.tokens):
+                text = f"word{i % 50} " if i % 40 else "\n\n## heading\n\n"
+                yield {"content": text}, i
+            completion = self.tokens
+
+        yield (
+            None,
+            {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion,
+                "total_tokens": prompt_tokens + completion,
+            },
+        )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._json({"object": "list", "data": [{"id": "fake", "object": "model"}]})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        fake = self.server.fake
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        started = time.monotonic()
+        time.sleep(fake.ttft)
+        for delta, extra in fake.chunks(request):
+            chunk = {
+                "id": "fake",
+                "object": "chat.completion.chunk",
+                "created": int(started),
+                "model": request["model"],
+                "choices": [],
+            }
+            if delta is None:
+                chunk["usage"] = extra
+            else:
+                chunk["choices"] = [{"index": 0, "delta": delta, "finish_reason": None}]
+                if fake.tps:
+                    due = started + fake.ttft + extra / fake.tps
+                    time.sleep(max(0, due - time.monotonic()))
+            self._event(f"data: {json.dumps(chunk)}\n\n")
+        self._event("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _event(self, data: str):
+        body = data.encode()
+        self.wfile.write(f"{len(body):x}\r\n".encode() + body + b"\r\n")
+        self.wfile.flush()
+
+    def _json(self, value: dict):
+        body = json.dumps(value).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == "__main__":
+    fake = FakeOpenAI()
+    print(fake.start(int(sys.argv[1]) if len(sys.argv) > 1 else 0), flush=True)
+    threading.Event().wait()
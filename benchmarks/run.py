@@ -0,0 +1,237 @@
+"""Offline throughput, latency and memory benchmarks for the azx hot paths.
+
+Runs scripted scenarios against a fake OpenAI-compatible server and a dummy
+stdio MCP server inside a throwaway HOME, so no real API is called and no
+real sessions are touched. Rendering goes to a null console.
+
+    python benchmarks/run.py [--json out.json] [--compare base.json]
+
+Save the results of a baseline commit with --json, then run the same command
+on a later commit with --compare to print the change of every number and exit
+non-zero when one regressed by more than --threshold.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+here = os.path.dirname(os.path.abspath(__file__))
+home = tempfile.mkdtemp(prefix="azx-bench-")
+
+# everything under azx resolves ~ at import time, so HOME must be set first
+os.environ["HOME"] = home
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(here, "..", "src"))
+
+from fake_openai import FakeOpenAI  # noqa: E402
+
+fake = FakeOpenAI(tokens=400)
+base_url = fake.start()
+
+os.makedirs(os.path.join(home, ".azx"))
+with open(os.path.join(home, ".azx", "config.yaml"), "w") as f:
+    json.dump(
+        {
+            "keys": [
+                {
+                    "name": "fake",
+                    "base_url": base_url,
+                    "model": "fake",
+                    "api_key": "fake",
+                    "window": 1000000,
+                }
+            ],
+            "mcp": [
+                {
+                    "name": "fake",
+                    "cmd": sys.executable,
+                    "args": [os.path.join(here, "fake_mcp.py")],
+                    "autostart": True,
+                }
+            ],
+            "response_cache": 0,
+        },
+        f,
+    )
+
+
+class Scenario:
+    def __init__(self, name: str, ops: int):
+        self.name = name
+        self.ops = ops
+        self.latencies = []
+
+    def result(self, elapsed: float, peak: int) -> dict:
+        latencies = sorted(self.latencies) or [elapsed / self.ops]
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        return {
+            "ops_per_second": self.ops / elapsed,
+            "p50_ms": statistics.median(latencies) * 1000,
+            "p95_ms": p95 * 1000,
+            "peak_kib": peak / 1024,
+        }
+
+
+async def measure(scenario: Scenario, run) -> dict:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    await run(scenario)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return scenario.result(elapsed, peak)
+
+
+async def render(scenario: Scenario):
+    from azx import renderer
+
+    renderer.console.file = open(os.devnull, "w")
+    deltas = [
+        f"word{i % 50} " if i % 40 else "\n\n```python\nprint(1)\n```\n\n- item\n"
+        for i in range(2000)
+    ]
+    for _ in range(scenario.ops):
+        started = time.perf_counter()
+        renderer.render_md_stream(deltas)
+        scenario.latencies.append(time.perf_counter() - started)
+
+
+async def calls(scenario: Scenario):
+    from azx.tools import Calls
+
+    buffer = {
+        i: {"id": f"call_{i}", "fn": {"name": "echo", "args": '{"text": "hi"}'}}
+        for i in range(8)
+    }
+    for _ in range(scenario.ops):
+        started = time.perf_counter()
+        list(Calls(buffer))
+        scenario.latencies.append(time.perf_counter() - started)
+
+
+async def store(scenario: Scenario):
+    from azx.storage import Store
+
+    session = Store()
+    session.log("system", "benchmark")
+    for i in range(scenario.ops):
+        started = time.perf_counter()
+        session.log("user" if i % 2 else "assistant", f"message {i} " * 20)
+        scenario.latencies.append(time.perf_counter() - started)
+
+
+async def history(scenario: Scenario):
+    from azx import storage
+
+    for i in range(50):
+        session = storage.Store()
+        session.started_at = f"2000_0101_{i:06d}"
+        session.log("user", f"question {i}")
+    for _ in range(scenario.ops):
+        started = time.perf_counter()
+        storage.history()
+        scenario.latencies.append(time.perf_counter() - started)
+
+
+async def chat(scenario: Scenario):
+    from azx import renderer
+    from azx.chat import Chat
+
+    renderer.console.file = open(os.devnull, "w")
+    prompts = [
+        "use the tool please" if i % 4 == 0 else f"question {i}"
+        for i in range(scenario.ops)
+    ] + ["/q"]
+
+    class Script:
+        def __init__(self, chat: Chat):
+            self.chat = chat
+            self.asked_at = None
+
+        async def prompt_async(self):
+            await self.chat.autostart
+            if self.asked_at is not None:
+                scenario.latencies.append(time.perf_counter() - self.asked_at)
+            self.asked_at = time.perf_counter()
+            return prompts.pop(0)
+
+    session = Chat()
+    session.session = Script(session)
+    await session.run()
+    await session.tools.close()
+
+
+scenarios = {
+    "render_md_stream": (render, 20),
+    "calls": (calls, 20000),
+    "store_log": (store, 2000),
+    "history": (history, 50),
+    "chat_turn": (chat, 40),
+}
+
+
+def compare(results: dict, base: dict, threshold: float) -> bool:
+    regressed = False
+    print(f"\ncompared with {base.get('commit', '?')}:")
+    for name, metrics in results["scenarios"].items():
+        for metric, value in metrics.items():
+            old = base.get("scenarios", {}).get(name, {}).get(metric)
+            if not old:
+                continue
+            change = (value - old) / old
+            worse = -change if metric == "ops_per_second" else change
+            flag = "  REGRESSED" if worse > threshold else ""
+            regressed = regressed or bool(flag)
+            print(
+                f"  {name:18} {metric:15} {old:10.2f} -> {value:10.2f}"
+                f" ({change:+.0%}){flag}"
+            )
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--json", type=str, help="Write results to a JSON file")
+    parser.add_argument("--compare", type=str, help="Compare with a results file")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--only", nargs="*", help="Run only these scenarios")
+    options = parser.parse_args()
+
+    git = ["git", "rev-parse", "--short", "HEAD"]
+    commit = subprocess.run(git, capture_output=True, text=True, cwd=here).stdout
+    commit = commit.strip()
+    results = {"commit": commit, "python": platform.python_version(), "scenarios": {}}
+    for name, (run, ops) in scenarios.items():
+        if options.only and name not in options.only:
+            continue
+        result = asyncio.run(measure(Scenario(name, ops), run))
+        results["scenarios"][name] = result
+        print(
+            f"{name:18} {result['ops_per_second']:10.1f} ops/s"
+            f"  p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms"
+            f"  peak {result['peak_kib']:9.0f} KiB"
+        )
+    fake.stop()
+    shutil.rmtree(home, ignore_errors=True)
+
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            if compare(results, json.load(f), options.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
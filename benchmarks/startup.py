@@ -0,0 +1,81 @@
+"""Startup latency of the azx entry points.
+
+Reports the wall time of importing each entry module in a fresh interpreter,
+the slowest imports behind the chat entry, and the time from launching `azx`
+until the first `>>> ` prompt is drawn. Needs a ~/.azx/config.yaml.
+
+    python benchmarks/startup.py [runs]
+"""
+
+import os
+import pty
+import re
+import select
+import statistics
+import subprocess
+import sys
+import time
+
+modules = ["azx", "azx.ocr", "azx.chat"]
+
+
+def import_time(module: str, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def slowest_imports(module: str, limit: int = 10) -> list[tuple[int, str]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if match := re.match(r"import time:\s+\d+ \|\s+(\d+) \| (.+)$", line):
+            name = match.group(2)
+            if not name.startswith(" "):
+                rows.append((int(match.group(1)), name))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def first_prompt(runs: int, timeout: float = 10) -> float:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        pid, fd = pty.fork()
+        if pid == 0:
+            os.execv(sys.executable, [sys.executable, "-c", "import azx; azx.main()"])
+        output = b""
+        while b">>> " not in output:
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError(output.decode(errors="replace"))
+            if select.select([fd], [], [], 0.05)[0]:
+                output += os.read(fd, 1024)
+        samples.append(time.perf_counter() - started)
+        os.kill(pid, 9)
+        os.waitpid(pid, 0)
+        os.close(fd)
+    return statistics.median(samples)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    baseline = import_time("sys", runs)
+    print(f"interpreter: {baseline * 1000:.0f} ms")
+    for module in modules:
+        elapsed = import_time(module, runs) - baseline
+        print(f"import {module}: {elapsed * 1000:.0f} ms")
+    print("slowest imports behind azx.chat (cumulative):")
+    for us, name in slowest_imports("azx.chat"):
+        print(f"  {us / 1000:7.1f} ms  {name}")
+    print(f"first prompt: {first_prompt(runs) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
+import asyncio
 import base64
+import glob
+import hashlib
+import io
+import json
 import os
-from itertools import tee
+import threading
+import time
 from pathlib import Path
 
-from openai import OpenAI, NOT_GIVEN
+from . import telemetry
+from .cache import ResponseCache
 
 
 _mime_types = {
@@ -16,6 +23,9 @@ _mime_types = {
     ".tiff": "image/tiff",
 }
 
+# formats many vision APIs reject, always re-encoded when Pillow is available
+_unsupported = ("image/tiff", "image/bmp")
+
 _ocr_prompt = """
 Extract content from image.
 
@@ -27,72 +37,349 @@ If something looks like list in full text, represent it with legal markdown list
 """.strip()
 
 
+class Response:
+    def __init__(self, stream, on_complete=None, name=None, started=None):
+        self.stream = stream
+        self.tool_calls = {}
+        self.usage = None
+        self.on_complete = on_complete
+        self.parts = []
+        self.name = name
+        self.started = started or time.perf_counter()
+        self.first_at = None
+        # called on every raw chunk, including tool-call and usage chunks
+        self.heartbeat = None
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            if content := self._route(chunk):
+                yield content
+        self._completed()
+
+    def _completed(self):
+        if self.on_complete is not None and not self.tool_calls:
+            self.on_complete("".join(self.parts), self.usage)
+        if self.name is not None:
+            _record_usage(self.name, self.usage, self.started, self.first_at)
+
+    def _route(self, chunk):
+        if self.heartbeat is not None:
+            self.heartbeat()
+        usage = chunk.usage
+        if usage is not None and usage.total_tokens:
+            self.usage = usage
+
+        if not chunk.choices:
+            return None
+
+        delta = chunk.choices[0].delta
+        for t in delta.tool_calls or []:
+            if t.index not in self.tool_calls:
+                self.tool_calls[t.index] = {
+                    "id": t.id,
+                    "fn": {"name": t.function.name, "args": ""},
+                }
+            if t.function.arguments:
+                self.tool_calls[t.index]["fn"]["args"] += t.function.arguments
+
+        if self.first_at is None and (delta.content or delta.tool_calls):
+            self.first_at = time.perf_counter()
+        if self.on_complete is not None and delta.content:
+            self.parts.append(delta.content)
+        return delta.content
+
+
+class CachedResponse:
+    def __init__(self, content: str, usage: dict | None):
+        self.content = content
+        self.tool_calls = {}
+        from openai.types import CompletionUsage
+
+        self.usage = CompletionUsage.model_validate(usage) if usage else None
+
+    async def __aiter__(self):
+        yield self.content
+
+
+# (openai class, base_url, api_key) -> openai client, shared to keep connections alive
+_connections = {}
+_connections_lock = threading.Lock()
+
+
 class Client:
-    def __init__(self, name: str, base_url: str, model: str, api_key: str, tools):
+    # openai takes a while to import, so it is loaded on first use
+    _openai = "OpenAI"
+    _conn_keys = ("name", "base_url", "model", "api_key")
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        model: str,
+        api_key: str,
+        cache: ResponseCache | None = None,
+        image: dict | None = None,
+    ):
         self.name = name
         self.model = model
-        self.tools = tools
-        self._client = OpenAI(base_url=base_url, api_key=api_key)
+        self.cache = cache
+        self.image = image
+        self.uploaded = {"original": 0, "sent": 0}
+        self._client = _connect(self._openai, base_url, api_key)
+
+    @classmethod
+    def from_config(cls, model_cfg: dict, **options):
+        return cls(**{k: model_cfg[k] for k in cls._conn_keys}, **options)
+
+    def ocr(self, uri, prompt=_ocr_prompt) -> str:
+        key = self._ocr_key(uri, prompt)
+        hit = self.cache.get(key) if key else None
+        if hit and _is_ocr_answer(hit["content"]):
+            return hit["content"]
 
-    def stream_response(self, messages: list[dict], json: bool = False):
-        response_format = {"type": "json_object"} if json else NOT_GIVEN
-        tools = self.tools if self.tools else NOT_GIVEN
-        stream = self._client.chat.completions.create(
+        messages = _ocr_messages(uri, prompt, self.image, self.uploaded)
+        response = self._client.chat.completions.create(
             model=self.model,
             messages=messages,
-            tools=tools,
-            response_format=response_format,
-            stream=True,
-            stream_options={"include_usage": True},
+            response_format={"type": "json_object"},
         )
 
-        stream1, stream2 = tee(stream)
-        stream3, stream4 = tee(stream2)
+        content = response.choices[0].message.content
+        if key and _is_ocr_answer(content):
+            self.cache.put(key, {"content": content, "usage": None})
+        return content
 
-        return (
-            (
-                chunk.choices[0].delta.content
-                for chunk in stream1
-                if chunk.choices and chunk.choices[0].delta.content
-            ),
-            (
-                chunk.choices[0].delta.tool_calls
-                for chunk in stream3
-                if chunk.choices and chunk.choices[0].delta.tool_calls
-            ),
-            (
-                chunk.usage
-                for chunk in stream4
-                if chunk.usage is not None
-                and chunk.usage.total_tokens is not None
-                and chunk.usage.total_tokens > 0
+    def _ocr_key(self, uri, prompt) -> str | None:
+        # keyed on the file and the upload settings, so a hit skips reading,
+        # downscaling and encoding the image
+        if self.cache is None:
+            return None
+        source = uri
+        if os.path.exists(uri):
+            with open(uri, "rb") as f:
+                source = hashlib.file_digest(f, "sha256").hexdigest()
+        request = {"image": source, "settings": self.image, "prompt": prompt}
+        return self.cache.key(self.model, [request], {"type": "json_object"})
+
+    def _cache_key(self, messages: list[dict], json: bool) -> str | None:
+        if self.cache is None:
+            return None
+        response_format = {"type": "json_object"} if json else None
+        return self.cache.key(self.model, messages, response_format)
+
+    def _cache_put(self, key: str | None, json: bool):
+        if key is None:
+            return None
+
+        def put(content, usage):
+            # a malformed json answer would be replayed on every retry
+            if content and (not json or _is_json(content)):
+                usage = usage.model_dump() if usage else None
+                self.cache.put(key, {"content": content, "usage": usage})
+
+        return put
+
+
+class AsyncClient(Client):
+    _openai = "AsyncOpenAI"
+
+    async def stream_response(
+        self,
+        messages: list[dict],
+        json: bool = False,
+        cache: bool = False,
+        tools: list | None = None,
+    ) -> Response:
+        key = self._cache_key(messages, json) if cache else None
+        if key and (hit := self.cache.get(key)):
+            telemetry.record("llm", self.name, cache_hit=1)
+            return CachedResponse(**hit)
+        started = time.perf_counter()
+        return Response(
+            await self._client.chat.completions.create(
+                **_stream_args(self, messages, json, tools)
             ),
+            self._cache_put(key, json),
+            self.name,
+            started,
         )
 
-    def ocr(self, uri, prompt=_ocr_prompt) -> str:
-        if os.path.exists(uri):
-            with open(uri, "rb") as image_file:
-                base64_data = base64.b64encode(image_file.read()).decode("utf-8")
-                mime_type = _mime_types.get(Path(uri).suffix.lower(), "image/jpeg")
-                uri = f"data:{mime_type};base64,{base64_data}"
-
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": uri},
-                    },
-                    {"type": "text", "text": prompt},
-                ],
-            }
-        ]
+    async def warm(self):
+        # opens the TLS connection early, the answer itself is not needed
+        try:
+            await self._client.models.list()
+        except Exception:
+            pass
 
-        response = self._client.chat.completions.create(
+    async def ocr(self, uri, prompt=_ocr_prompt) -> str:
+        key = await asyncio.to_thread(self._ocr_key, uri, prompt)
+        hit = self.cache.get(key) if key else None
+        if hit and _is_ocr_answer(hit["content"]):
+            return hit["content"]
+
+        messages = await asyncio.to_thread(
+            _ocr_messages, uri, prompt, self.image, self.uploaded
+        )
+        response = await self._client.chat.completions.create(
             model=self.model,
             messages=messages,
             response_format={"type": "json_object"},
         )
 
-        return response.choices[0].message.content
+        content = response.choices[0].message.content
+        if key and _is_ocr_answer(content):
+            self.cache.put(key, {"content": content, "usage": None})
+        return content
+
+
+def _is_json(content: str) -> bool:
+    try:
+        json.loads(content)
+    except ValueError:
+        return False
+    return True
+
+
+def _is_ocr_answer(content: str | None) -> bool:
+    try:
+        answer = json.loads(content or "")
+    except ValueError:
+        return False
+    return isinstance(answer, dict) and "abstract" in answer and "full" in answer
+
+
+def _record_usage(name: str, usage, started: float, first_at: float | None):
+    ended = time.perf_counter()
+    values = {"seconds": ended - started}
+    if first_at is not None:
+        values["ttft"] = first_at - started
+    if usage is not None:
+        values["prompt_tokens"] = usage.prompt_tokens
+        values["completion_tokens"] = usage.completion_tokens
+        if details := getattr(usage, "prompt_tokens_details", None):
+            values["cached_tokens"] = details.cached_tokens
+        if first_at is not None and ended > first_at:
+            values["tokens_per_second"] = usage.completion_tokens / (ended - first_at)
+    telemetry.record("llm", name, **values)
+
+
+def _connect(openai_class: str, base_url: str, api_key: str):
+    with _connections_lock:
+        key = (openai_class, base_url, api_key)
+        if key not in _connections:
+            import openai
+
+            _connections[key] = getattr(openai, openai_class)(
+                base_url=base_url, api_key=api_key
+            )
+        return _connections[key]
+
+
+def _stream_args(
+    client: Client, messages: list[dict], json: bool, tools: list | None
+) -> dict:
+    from openai import NOT_GIVEN
+
+    return {
+        "model": client.model,
+        "messages": messages,
+        "tools": tools if tools else NOT_GIVEN,
+        "response_format": {"type": "json_object"} if json else NOT_GIVEN,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+
+
+def _shrink(data: bytes, mime_type: str, image: dict | None) -> tuple[bytes, str]:
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return data, mime_type
+
+    # without ocr_image only the format changes, losslessly and at full size
+    options = image if image is not None else {"format": "png", "max_side": None}
+    fmt = options.get("format", "jpeg").lower()
+    fmt = "jpeg" if fmt == "jpg" else fmt
+    max_side = options.get("max_side", 2048)
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img = ImageOps.exif_transpose(img)
+            if max_side:
+                img.thumbnail((max_side, max_side))
+            img = _encodable(img, fmt)
+            out = io.BytesIO()
+            img.save(
+                out, format=fmt, quality=options.get("quality", 85), optimize=True
+            )
+    except (OSError, ValueError, KeyError):
+        # an image Pillow cannot decode or re-encode is sent as it is
+        return data, mime_type
+
+    if len(out.getvalue()) >= len(data) and mime_type not in _unsupported:
+        return data, mime_type
+    return out.getvalue(), f"image/{fmt}"
+
+
+def _encodable(img, fmt: str):
+    from PIL import Image
+
+    if img.mode == "P" and "transparency" in img.info:
+        img = img.convert("RGBA")
+    if img.mode in ("I", "F") or img.mode.startswith("I;"):
+        # high bit depth scans are stretched into 8 bits rather than clipped
+        img = img.convert("F")
+        low, high = img.getextrema()
+        scale = 255 / (high - low) if high > low else 1
+        img = img.point(lambda v: (v - low) * scale).convert("L")
+    if img.mode in ("RGBA", "LA", "PA"):
+        if fmt != "jpeg":
+            return img if img.mode != "PA" else img.convert("RGBA")
+        # jpeg has no alpha, so transparent pixels go onto white instead
+        # of keeping the colour they store, which is usually black
+        flat = Image.new("RGB", img.size, "white")
+        flat.paste(img.convert("RGBA"), mask=img.getchannel("A"))
+        return flat
+    if img.mode in ("RGB", "L") or (img.mode in ("1", "P") and fmt == "png"):
+        return img
+    return img.convert("RGB")
+
+
+def image_files(patterns: list[str]) -> list[str]:
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths = sorted(str(p) for p in Path(pattern).rglob("*") if p.is_file())
+            files.extend(p for p in paths if Path(p).suffix.lower() in _mime_types)
+        elif matches := sorted(glob.glob(pattern, recursive=True)):
+            files.extend(matches)
+        else:
+            files.append(pattern)
+    return list(dict.fromkeys(files))
+
+
+def _ocr_messages(uri, prompt, image=None, uploaded=None) -> list[dict]:
+    if os.path.exists(uri):
+        with open(uri, "rb") as image_file:
+            data = image_file.read()
+        mime_type = _mime_types.get(Path(uri).suffix.lower(), "image/jpeg")
+        original = len(data)
+        if image is not None or mime_type in _unsupported:
+            data, mime_type = _shrink(data, mime_type, image)
+        if uploaded is not None:
+            uploaded["original"] += original
+            uploaded["sent"] += len(data)
+        base64_data = base64.b64encode(data).decode("utf-8")
+        uri = f"data:{mime_type};base64,{base64_data}"
+
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image_url",
+                    "image_url": {"url": uri},
+                },
+                {"type": "text", "text": prompt},
+            ],
+        }
+    ]
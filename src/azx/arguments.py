@@ -7,6 +7,21 @@ def parse():
     parser.add_argument("--ocr", action="store_true", help="OCR.")
     parser.add_argument("--models", action="store_true", help="List models")
     parser.add_argument("--model", type=str, help="Select a model", default=None)
-    parser.add_argument("files", nargs="*", help="One or more file paths.")
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Bypass the response cache"
+    )
+    parser.add_argument(
+        "-o", "--output", "--out", type=str, help="Append results to a JSONL file"
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="Concurrent requests")
+    parser.add_argument(
+        "--retries", type=int, default=2, help="Retries for a failed request"
+    )
+    parser.add_argument(
+        "--batch", type=str, help="Run prompts from a JSONL file, '-' for stdin"
+    )
+    parser.add_argument(
+        "files", nargs="*", help="Files, directories or globs, '-' reads stdin."
+    )
 
     return parser.parse_args()
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import os
+import sys
+import time
+
+from .agents import AsyncClient
+from .cache import open_cache
+from .configure import Configure
+from .routing import Router
+from .tools import Calls, Tools
+
+config = Configure()
+
+
+class RateLimit:
+    def __init__(self, rpm: float | None):
+        self.interval = 60 / rpm if rpm else 0
+        self.next_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            delay = self.next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_at = max(self.next_at, time.monotonic()) + self.interval
+
+
+class Limited:
+    # each endpoint has its own rpm, so the router's fallbacks are throttled apart
+    def __init__(self, client: AsyncClient, rpm: float | None):
+        self.client = client
+        self.name = client.name
+        self.limit = RateLimit(rpm)
+
+    async def stream_response(self, messages: list[dict], **options):
+        await self.limit.wait()
+        return await self.client.stream_response(messages, **options)
+
+
+class Conversation:
+    def __init__(self, client: Router, tools: Tools):
+        self.client = client
+        self.tools = tools
+
+    async def run(self, messages: list[dict], max_turns: int = 32) -> dict:
+        usage = {"prompt_tokens": 0, "completion_tokens": 0}
+        for _ in range(max_turns):
+            response = await self.client.stream_response(
+                messages, tools=self.tools.definitions
+            )
+            output = "".join([c async for c in response])
+            if response.usage:
+                usage["prompt_tokens"] += response.usage.prompt_tokens
+                usage["completion_tokens"] += response.usage.completion_tokens
+
+            calls = list(Calls(response.tool_calls))
+            if not calls:
+                return {"output": output, "usage": usage}
+
+            messages.append(
+                {
+                    "role": "assistant",
+                    "content": output,
+                    "tool_calls": [
+                        {
+                            "id": call.id,
+                            "type": "function",
+                            "function": {
+                                "name": call.fn,
+                                "arguments": json.dumps(call.params),
+                            },
+                        }
+                        for call in calls
+                    ],
+                }
+            )
+            for call, result in zip(calls, await self.tools.execute_all(calls)):
+                messages.append(
+                    {
+                        "role": "tool",
+                        "tool_call_id": call.id,
+                        "name": call.fn,
+                        "content": json.dumps(result),
+                    }
+                )
+        raise RuntimeError(f"no answer after {max_turns} turns")
+
+
+async def batch(args):
+    model = config.find_model(args.model) if args.model else config.default_chat_model()
+    done = _done(args.output) if args.output else set()
+    pending = asyncio.Queue()
+    for request in _requests(args.batch):
+        if request["id"] not in done:
+            pending.put_nowait(request)
+
+    tools = Tools(config.tool_concurrency(), config.tool_cache_entries())
+    await tools.add_mcps(config.autostart_tools())
+    max_bytes = None if args.no_cache else config.response_cache()
+    cache = open_cache(max_bytes)
+    client = Router(
+        [
+            Limited(AsyncClient.from_config(m, cache=cache), m.get("rpm"))
+            for m in [model] + config.fallbacks(model)
+        ],
+        **config.routing(),
+    )
+    conversation = Conversation(client, tools)
+    out = open(args.output, "a") if args.output else sys.stdout
+
+    async def worker():
+        while not pending.empty():
+            request = pending.get_nowait()
+            record = await _run_one(conversation, request, args.retries)
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+    try:
+        await asyncio.gather(*[worker() for _ in range(max(1, args.jobs))])
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        await tools.close()
+
+
+async def _run_one(conversation: Conversation, request: dict, retries: int) -> dict:
+    error = None
+    for attempt in range(retries + 1):
+        try:
+            result = await conversation.run(_messages(request))
+            return {"id": request["id"]} | result | {"error": None}
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if attempt < retries:
+                await asyncio.sleep(min(2**attempt, 30))
+    return {"id": request["id"], "output": None, "usage": None, "error": error}
+
+
+def _messages(request: dict) -> list[dict]:
+    if "messages" in request:
+        return [dict(msg) for msg in request["messages"]]
+    return [
+        {"role": "system", "content": config.default_chat_prompt()},
+        {"role": "user", "content": request["prompt"]},
+    ]
+
+
+def _requests(path: str):
+    if path == "-":
+        yield from _parse(sys.stdin)
+        return
+    with open(path, "r") as f:
+        yield from _parse(f)
+
+
+def _parse(lines):
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if isinstance(request, str):
+            request = {"prompt": request}
+        yield {"id": i + 1} | request
+
+
+def _done(output: str) -> set:
+    done = set()
+    if os.path.exists(output):
+        with open(output, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not record.get("error"):
+                    done.add(record["id"])
+    return done
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+
+cache_dir = os.path.expanduser("~/.azx/cache")
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = 256 << 20, path: str = cache_dir):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = None
+
+    def key(self, model: str, messages: list, response_format=None) -> str:
+        payload = json.dumps(
+            [model, messages, response_format], sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        try:
+            with open(self._file(key), "r") as f:
+                value = json.load(f)
+            os.utime(self._file(key))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: dict):
+        data = json.dumps(value, ensure_ascii=False)
+        os.makedirs(os.path.dirname(self._file(key)), exist_ok=True)
+        with open(self._file(key), "w") as f:
+            f.write(data)
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self._entries())
+        else:
+            self.size += len(data.encode())
+        if self.size > self.max_bytes:
+            self._evict()
+
+    def stats(self) -> str:
+        size = self.size if self.size is not None else 0
+        return f"hits: {self.hits}, misses: {self.misses}, size: {size >> 10} KiB"
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        self.size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.size <= self.max_bytes * 0.8:
+                break
+            os.remove(path)
+            self.size -= size
+
+    def _entries(self):
+        if not os.path.exists(self.path):
+            return
+        for shard in os.scandir(self.path):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                stat = entry.stat()
+                yield entry.path, stat.st_size, stat.st_mtime
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+
+def open_cache(max_bytes: int | None) -> ResponseCache | None:
+    return ResponseCache(max_bytes) if max_bytes else None
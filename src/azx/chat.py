@@ -0,0 +1,450 @@
+import asyncio
+import os
+import re
+import time
+import traceback
+
+from . import prompt
+from . import telemetry
+from .agents import AsyncClient
+from .cache import open_cache
+from .configure import Configure
+from .documents import Library
+from .renderer import (
+    render_error,
+    render_md_full,
+    render_md_stream,
+    render_md_stream_async,
+    render_panes_async,
+    render_sys_stream,
+    render_sys_stream_async,
+    render_user_input,
+)
+from .routing import Router
+from .storage import Store, history, search_history
+from .tokens import Estimator, text_tokens
+from .tools import Calls, Tools
+
+config = Configure()
+
+
+class Chat:
+    def __init__(self, no_cache: bool = False):
+        self.model = config.default_chat_model()
+        self.tools = Tools(config.tool_concurrency(), config.tool_cache_entries())
+        self.session = prompt.session()
+        self.store = None
+        self.autostart = None
+        self.estimator = Estimator()
+        self.rolling = None
+        self.cache = open_cache(None if no_cache else config.response_cache())
+        self.library = Library()
+        self.connecting = None
+        self.connect_lock = asyncio.Lock()
+        self.comparing = None
+        self.compared = None
+
+    async def run(self):
+        self.autostart = asyncio.create_task(
+            self.tools.add_mcps(config.autostart_tools())
+        )
+        # the prompt shows while openai loads, the first message waits for it
+        self.connecting = asyncio.create_task(self._new_client(warm=config.prewarm()))
+
+        while True:
+            try:
+                user_input = await self.session.prompt_async()
+
+                # handle command
+                user_cmd = user_input.strip().lower()
+                if user_cmd in ("/q", "/quit"):
+                    break
+
+                if await self._other_command(user_cmd, user_input.strip()):
+                    continue
+
+                # handle chat
+                await self.connecting
+                if self.store is None:
+                    self.store = Store(config.fsync_interval())
+                    self.store.log("system", config.default_chat_prompt())
+
+                if self.comparing:
+                    await self._compare(user_input)
+                    continue
+
+                # excerpts follow the question so they belong to the pending turn
+                # and survive compaction before it is sent
+                shown = _shown(self.store.conversation)
+                self.store.log("user", user_input)
+                if excerpts := self.library.relevant(user_input, shown=shown):
+                    self.store.log("system", _excerpts(excerpts))
+
+                while True:
+                    raw = self.estimator.raw(
+                        self.store.conversation, self.tools.definitions
+                    )
+                    if self.estimator.predict(raw) > self._window():
+                        await self._compact(
+                            self.estimator.predict(raw), self._pending()
+                        )
+                        raw = self.estimator.raw(
+                            self.store.conversation, self.tools.definitions
+                        )
+                    response = await self.client.stream_response(
+                        self.store.conversation, tools=self.tools.definitions
+                    )
+                    whole_output = await render_md_stream_async(response)
+                    self.store.log("assistant", whole_output)
+                    calls = list(Calls(response.tool_calls))
+                    for call in calls:
+                        render_sys_stream(f"{call.fn}({call.params_str()})")
+                    results = await self.tools.execute_all(calls)
+                    for call, result in zip(calls, results):
+                        self.store.tool(call.id, call.fn, call.params_str(), result)
+                    # the tool loop goes on, so the pending turn must survive the note
+                    keep = self._pending() if calls else 0
+                    await self._auto_compact(response.usage, raw, keep)
+                    if not calls:
+                        break
+
+                self._roll_in_background()
+                self.store.flush()
+                if path := config.prometheus_textfile():
+                    telemetry.export(os.path.expanduser(path))
+
+            except Exception as e:
+                render_error(f"Error: {e}\n{traceback.format_exc()}")
+
+    async def _auto_compact(self, usage, raw, keep=0):
+        if usage:
+            self.estimator.calibrate(raw, usage.prompt_tokens)
+        await self._compact(usage.total_tokens if usage else 0, keep)
+
+    async def _compact(self, size, keep=0):
+        self.store.usage = size
+        while self.store.usage > self._window():
+            # a roll in flight rewrites the conversation, so wait only when
+            # compaction is about to read it
+            await self._rolled()
+            started = time.perf_counter()
+            response = await self.client.stream_response(
+                self.store.compaction(),
+                json=True,
+                cache=True,
+            )
+            error = self.estimator.error
+            estimate = f", estimate error {error:+.0%}" if error is not None else ""
+            render_sys_stream(
+                f"<<< taking note: {self.store.usage} tokens{estimate} ..."
+            )
+            whole_output = await render_sys_stream_async(response)
+            token_used = response.usage.completion_tokens if response.usage else 0
+            render_sys_stream(f"<<< note taken: {token_used}/{self.store.usage}")
+            telemetry.record(
+                "compaction",
+                self.client.name,
+                seconds=time.perf_counter() - started,
+                before=self.store.usage,
+                after=token_used,
+            )
+            if len(whole_output) == 0:
+                await asyncio.sleep(1)
+                continue
+            self.store.usage = token_used
+            self.store.note(whole_output, keep)
+
+    def _roll_in_background(self):
+        keep_turns = config.rolling_compaction()
+        if not keep_turns or (self.rolling and not self.rolling.done()):
+            return
+        if self.store.usage > self._window() // 2:
+            self.rolling = asyncio.create_task(self._roll(self.store, keep_turns))
+
+    async def _roll(self, store, keep_turns):
+        compaction = store.rolling_compaction(keep_turns)
+        if compaction is None:
+            return
+        messages, cut = compaction
+        try:
+            response = await self.client.stream_response(
+                messages, json=True, cache=True
+            )
+            note = "".join([c async for c in response])
+        except Exception as e:
+            render_error(f"Rolling compaction failed: {e}")
+            return
+        if note:
+            store.fold(note, cut, messages[0])
+
+    async def _rolled(self):
+        if self.rolling is not None:
+            await self.rolling
+            self.rolling = None
+
+    def _pending(self) -> int:
+        roles = [msg["role"] for msg in self.store.conversation]
+        return len(roles) - max(i for i, role in enumerate(roles) if role == "user")
+
+    async def _compare(self, user_input):
+        added = [{"role": "user", "content": user_input}]
+        shown = _shown(self.store.conversation)
+        if excerpts := self.library.relevant(user_input, shown=shown):
+            added.append({"role": "system", "content": _excerpts(excerpts)})
+        messages = self.store.conversation + added
+
+        contenders = {
+            f"{i + 1}. {c.model['name']}": c for i, c in enumerate(self.comparing)
+        }
+        answers = await render_panes_async(
+            {title: c.stream(messages) for title, c in contenders.items()},
+            lambda title: contenders[title].caption(),
+        )
+        self.compared = (added, list(zip(self.comparing, answers.values())))
+        render_sys_stream("<<< /keep <n> to continue with an answer")
+
+    def _window(self) -> int:
+        return self.model.get("window", 3600)
+
+    async def _client_for(self, model: dict) -> AsyncClient:
+        # connections are pooled per base_url and api_key, so this is cheap
+        # after the first client of a provider
+        return await asyncio.to_thread(AsyncClient.from_config, model, cache=self.cache)
+
+    async def _new_client(self, warm: bool = False):
+        async with self.connect_lock:
+            models = [self.model] + config.fallbacks(self.model)
+            clients = [await self._client_for(model) for model in models]
+            self.client = Router(clients, **config.routing())
+        if warm:
+            await self.client.warm()
+
+    async def _other_command(self, user_cmd, user_input):
+        if match := re.match(r"^(?:/c|/client)$", user_cmd):
+            render_md_full(f"clients:\n{config.models()}")
+            return True
+
+        if match := re.match(r"^(?:/c|/client) (.+)$", user_cmd):
+            name = match.group(1)
+            client2_cfg = config.find_model(name)
+            if client2_cfg:
+                self.model = client2_cfg
+                await self._new_client()
+                print(f"Switched to client: {client2_cfg['name']}")
+            else:
+                print(f"Client '{name}' not found in config")
+            return True
+
+        if match := re.match(r"^/attach (.+)$", user_cmd):
+            path = os.path.expanduser(user_input[len("/attach ") :].strip())
+            try:
+                count = await asyncio.to_thread(self.library.attach, path)
+                render_sys_stream(f"<<< attached {path}: {count} chunks")
+            except Exception as e:
+                render_error(f"Fail to attach {path}: {e}")
+            return True
+
+        if re.match(r"^/compare(?: .+)?$", user_cmd):
+            names = user_input.split()[1:]
+            models = [config.find_model(name) for name in names]
+            if not names:
+                self.comparing = self.compared = None
+                render_sys_stream("<<< compare mode off")
+            elif None in models:
+                print(f"Client '{names[models.index(None)]}' not found in config")
+            elif len(models) < 2:
+                print("Compare needs at least two clients")
+            else:
+                self.comparing = [
+                    Contender(model, await self._client_for(model)) for model in models
+                ]
+                self.compared = None
+                render_sys_stream(f"<<< comparing {', '.join(names)}")
+            return True
+
+        if match := re.match(r"^/keep (\d+)$", user_cmd):
+            n = int(match.group(1))
+            if not self.compared or not 0 < n <= len(self.compared[1]):
+                print("Nothing to keep")
+                return True
+            added, answers = self.compared
+            contender, answer = answers[n - 1]
+            for msg in added:
+                self.store.log(msg["role"], msg["content"])
+            self.store.log("assistant", answer)
+            self.comparing = self.compared = None
+            self.model = contender.model
+            await self._new_client()
+            print(f"Switched to client: {self.model['name']}")
+            return True
+
+        if user_cmd in ("/n", "/new"):
+            self.store = None
+            self.compared = None
+            return True
+
+        if match := re.match(r"^(?:/r|/resume)$", user_cmd):
+            render_md_full(f"history:\n{history()}")
+            return True
+
+        if match := re.match(r"^(?:/r|/resume) (.+)$", user_cmd):
+            started_at = (
+                history().split("\n")[int(match.group(1)) - 1].split(" ")[1].strip("*")
+            )
+            self.store = Store(config.fsync_interval())
+            self.store.resume(started_at)
+            for msg in self.store.conversation:
+                if msg["role"] == "user":
+                    render_user_input(msg["content"])
+                elif msg["role"] == "system":
+                    render_sys_stream(msg["content"])
+                elif msg["role"] == "assistant":
+                    render_md_stream(msg["content"])
+                    for fn in msg.get("tool_calls", []):
+                        render_sys_stream(
+                            f"{fn['function']['name']}({fn['function']['arguments']})"
+                        )
+            if self.store.cursor:
+                render_sys_stream("<<< earlier messages folded, /earlier to page back")
+            return True
+
+        if match := re.match(r"^/search (.+)$", user_cmd):
+            render_md_full(f"found:\n{search_history(match.group(1))}")
+            return True
+
+        if user_cmd in ("/e", "/earlier"):
+            records = self.store.earlier(20) if self.store else []
+            if not records:
+                render_sys_stream("<<< nothing earlier")
+            for record in records:
+                if record["role"] == "user":
+                    render_user_input(record["content"])
+                elif record["role"] == "assistant":
+                    render_md_stream(record["content"])
+                elif record["role"] == "tool":
+                    render_sys_stream(f"{record['name']}({record['args']})")
+                else:
+                    render_sys_stream(record["content"])
+            return True
+
+        if user_cmd in ("/s", "/sum", "/summary"):
+            talk = self.store.conversation.copy()
+            talk.append(
+                {
+                    "role": "user",
+                    "content": "Summarize all talk above briefly, use single language, which is the primary language involved, with words or phrases, in one line. Your answer could contain verb/object/attribute/adverbial/complement, but no subject. Just give me the answer, no thought is need",
+                }
+            )
+            response = await self.client.stream_response(talk, cache=True)
+            sum = "".join([c async for c in response])
+            self.store.summary(sum)
+            render_md_stream([sum])
+            return True
+
+        if user_cmd == "/stats":
+            render_md_full(f"session:\n\n{telemetry.stats()}")
+            overall = await asyncio.to_thread(telemetry.stats, True)
+            render_md_full(f"overall:\n\n{overall}")
+            return True
+
+        if user_cmd == "/cache":
+            stats = self.cache.stats() if self.cache else "disabled"
+            render_sys_stream(f"<<< response cache: {stats}")
+            render_sys_stream(f"<<< tool cache: {self.tools.cache.stats()}")
+            return True
+
+        if user_cmd in ("/tools"):
+            render_md_full(f"tools:\n{config.tools()}")
+            return True
+
+        if match := re.match(r"^/tool\+ (.+)$", user_cmd):
+            t = config.find_tool(match.group(1))
+            await self.tools.add_mcp(
+                t["cmd"],
+                t["args"],
+                t.get("concurrency"),
+                t.get("namespace"),
+                t.get("cache"),
+            )
+            return True
+
+        if match := re.match(r"^/tool\- (.+)$", user_cmd):
+            t = config.find_tool(match.group(1))
+            await self.tools.del_mcp(t["cmd"], t["args"])
+            return True
+
+        if user_cmd in ("/?", "/help") or re.match(r"^/[a-zA-Z0-9]+$", user_cmd):
+            manual = "\n".join(
+                [
+                    f"- {cmd}"
+                    for cmd in [
+                        "/? /help",
+                        "/c /client",
+                        "/n /new",
+                        "/r /resume",
+                        "/e /earlier",
+                        "/search <terms>",
+                        "/attach <path>",
+                        "/s /sum /summary",
+                        "/compare <clients...>",
+                        "/keep <n>",
+                        "/cache",
+                        "/stats",
+                        "/q /quit",
+                    ]
+                ],
+            )
+            render_md_full(f"commands:\n{manual}")
+            return True
+
+        return False
+
+
+class Contender:
+    def __init__(self, model: dict, client: AsyncClient):
+        self.model = model
+        self.client = client
+        self.started_at = None
+        self.first_at = None
+        self.ended_at = None
+        self.tokens = None
+        # tok/s is estimated from these until usage reports the token count
+        self.parts = []
+
+    async def stream(self, messages: list[dict]):
+        self.started_at = time.monotonic()
+        self.first_at = self.ended_at = self.tokens = None
+        self.parts = []
+        response = await self.client.stream_response(messages)
+        async for delta in response:
+            if delta:
+                if self.first_at is None:
+                    self.first_at = time.monotonic()
+                self.parts.append(delta)
+            yield delta
+        self.ended_at = time.monotonic()
+        self.tokens = response.usage.completion_tokens if response.usage else None
+
+    def caption(self) -> str:
+        if self.started_at is None:
+            return "waiting"
+        if self.first_at is None:
+            return f"waiting {time.monotonic() - self.started_at:.1f}s"
+        caption = f"ttft {self.first_at - self.started_at:.2f}s"
+        ended_at = self.ended_at or time.monotonic()
+        tokens = self.tokens or text_tokens("".join(self.parts))
+        if tokens and ended_at > self.first_at:
+            speed = tokens / (ended_at - self.first_at)
+            approx = "" if self.tokens else "~"
+            caption += f" · {approx}{speed:.0f} tok/s"
+        return caption
+
+
+def _shown(conversation: list[dict]) -> str:
+    # excerpts still in the conversation are not pulled in again
+    return "\n".join(m["content"] for m in conversation if m["role"] == "system")
+
+
+def _excerpts(excerpts: list[tuple[str, str]]) -> str:
+    quoted = "\n\n".join(f"<<< {path}\n\n{chunk}" for path, chunk in excerpts)
+    return f"Excerpts from attached documents:\n\n{quoted}"
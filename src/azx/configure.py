@@ -1,7 +1,7 @@
+import json
+import os
 from pathlib import Path
 
-import yaml
-
 sys_prompt = """
 You are an assistant integrated with a chat loop that can call external functions to enhance responses.
 
@@ -17,8 +17,26 @@ When a function is called, it returns a JSON object with the following structure
 class Configure:
     def __init__(self):
         config_path = Path.home() / ".azx" / "config.yaml"
+        cache_path = Path.home() / ".azx" / "config.cache.json"
+        mtime = config_path.stat().st_mtime_ns
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached["mtime"] == mtime:
+                self.config = cached["config"]
+                return
+        except (OSError, ValueError, KeyError):
+            pass
+
+        # yaml is only needed when config.yaml changed since the last run
+        import yaml
+
         with open(config_path) as f:
             self.config = yaml.safe_load(f)
+        try:
+            _write_private(cache_path, {"mtime": mtime, "config": self.config})
+        except (OSError, TypeError, ValueError):
+            pass
 
     def models(self) -> str:
         return "\n".join(
@@ -42,6 +60,42 @@ class Configure:
                 return k
         return None
 
+    def autostart_tools(self) -> list[dict]:
+        return [t for t in self.config.get("mcp", []) if t.get("autostart")]
+
+    def fsync_interval(self) -> float | None:
+        return self.config.get("fsync_interval", None)
+
+    def rolling_compaction(self) -> int | None:
+        return self.config.get("rolling_compaction", None)
+
+    def response_cache(self) -> int | None:
+        size = self.config.get("response_cache", 256)
+        return size << 20 if size else None
+
+    def tool_concurrency(self) -> int:
+        return self.config.get("tool_concurrency", 8)
+
+    def ocr_image(self) -> dict | None:
+        return self.config.get("ocr_image", None)
+
+    def fallbacks(self, model: dict) -> list[dict]:
+        names = model.get("fallback", [])
+        names = [names] if isinstance(names, str) else names
+        return [m for m in map(self.find_model, names) if m is not None]
+
+    def routing(self) -> dict:
+        return self.config.get("routing", {})
+
+    def prometheus_textfile(self) -> str | None:
+        return self.config.get("prometheus_textfile", None)
+
+    def prewarm(self) -> bool:
+        return self.config.get("prewarm", False)
+
+    def tool_cache_entries(self) -> int:
+        return self.config.get("tool_cache_entries", 256)
+
     def default_chat_model(self) -> dict:
         return self.config["keys"][0]
 
@@ -56,3 +110,16 @@ class Configure:
             if self.config["cli_ocr"] == k["name"]:
                 return k
         return None
+
+
+def _write_private(path: Path, value: dict):
+    # the config holds api keys, so the cache is only readable by its owner
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
@@ -0,0 +1,183 @@
+import hashlib
+import math
+import os
+import re
+from collections import Counter
+
+cache_dir = os.path.expanduser("~/.azx/documents")
+
+_heading_re = re.compile(r"(?:#{1,6} [^\n]*\s*)+")
+_terms_re = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]|[^\W_]+")
+
+# words that match nearly every chunk, so a question made of them pulls nothing
+_stopwords = frozenset(
+    """
+    a an and are as at be but by can could did do does for from had has have he her
+    him his how i if in into is it its just me my no not of on or our she so than
+    that the their them then there these they this those to too was we were what
+    when where which who why will with would you your ok okay yes thanks thank
+    please hi hello
+    的 了 是 我 你 他 她 它 们 这 那 在 有 和 就 也 都 吗 呢 吧 啊 个 不 一 么 什 谢
+    """.split()
+)
+
+# (path, size, mtime_ns) -> content hash, so unchanged files are not re-read
+_digests: dict[tuple, str] = {}
+
+
+def convert(path: str) -> str:
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if (digest := _digests.get(key)) is None:
+        with open(path, "rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+        _digests[key] = digest
+
+    cached = os.path.join(cache_dir, f"{digest}.md")
+    if os.path.exists(cached):
+        with open(cached, "r") as f:
+            return f.read()
+
+    from markitdown import MarkItDown
+
+    markdown = MarkItDown().convert(path).text_content
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cached + ".tmp", "w") as f:
+        f.write(markdown)
+    os.replace(cached + ".tmp", cached)
+    return markdown
+
+
+def split(markdown: str, size: int = 2000) -> list[str]:
+    chunks = []
+    current = ""
+    heading = ""
+    for block in re.split(r"\n(?=#{1,6} )|\n\s*\n", markdown):
+        block = block.strip()
+        if not block:
+            continue
+        # a bare heading line travels with the block that follows it, so the
+        # two always land in the same chunk
+        if heading:
+            block = f"{heading}\n\n{block}"
+            heading = ""
+        if _heading_re.fullmatch(block):
+            heading = block
+            continue
+        if current and len(current) + len(block) + 2 > size:
+            chunks.append(current)
+            current = ""
+        while len(block) > size:
+            chunks.append(block[:size])
+            block = block[size:]
+        current = f"{current}\n\n{block}" if current else block
+    if heading:
+        current = f"{current}\n\n{heading}" if current else heading
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class Library:
+    def __init__(
+        self,
+        k1: float = 1.2,
+        b: float = 0.75,
+        min_share: float = 0.3,
+        min_score: float = 0.5,
+        max_df: float = 0.5,
+        min_chunks: int = 4,
+    ):
+        self.k1 = k1
+        self.b = b
+        # bm25 scores shrink with the library size, so a chunk must reach a
+        # share of the best chunk's score as well as a small absolute floor
+        self.min_share = min_share
+        self.min_score = min_score
+        # terms found in more than this share of chunks say nothing about which
+        # chunk is meant, so they are ignored
+        self.max_df = max_df
+        # with fewer chunks document frequency says little, so neither common
+        # terms nor low scores are dropped
+        self.min_chunks = min_chunks
+        self.chunks: list[tuple[str, str]] = []
+        self.terms: list[Counter] = []
+        self.df = Counter()
+        # path -> (size, mtime_ns) of the attached version
+        self.paths: dict[str, tuple[int, int]] = {}
+
+    def attach(self, path: str) -> int:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = (stat.st_size, stat.st_mtime_ns)
+        if self.paths.get(path) == version:
+            return 0
+        self._detach(path)
+        chunks = split(convert(path))
+        for chunk in chunks:
+            terms = Counter(_terms(chunk))
+            self.chunks.append((path, chunk))
+            self.terms.append(terms)
+            self.df.update(terms.keys())
+        self.paths[path] = version
+        return len(chunks)
+
+    def relevant(
+        self, question: str, limit: int = 4, shown: str = ""
+    ) -> list[tuple[str, str]]:
+        n = len(self.chunks)
+        large = n >= self.min_chunks
+        words = {
+            w
+            for w in set(_terms(question)) - _stopwords
+            if 0 < self.df[w] and not (large and self.df[w] > self.max_df * n)
+        }
+        if not words:
+            return []
+
+        avg = sum(t.total() for t in self.terms) / n
+        idf = {
+            w: math.log(1 + (n - self.df[w] + 0.5) / (self.df[w] + 0.5)) for w in words
+        }
+
+        scores = []
+        for i, terms in enumerate(self.terms):
+            norm = self.k1 * (1 - self.b + self.b * terms.total() / avg)
+            score = sum(
+                idf[w] * terms[w] * (self.k1 + 1) / (terms[w] + norm)
+                for w in words
+                if w in terms
+            )
+            if score > 0:
+                scores.append((score, i))
+        if not scores:
+            return []
+
+        cutoff = self.min_share * max(scores)[0]
+        if large:
+            cutoff = max(cutoff, self.min_score)
+        ranked = [
+            i
+            for score, i in sorted(scores, reverse=True)
+            if score >= cutoff and self.chunks[i][1] not in shown
+        ]
+        return [self.chunks[i] for i in sorted(ranked[:limit])]
+
+    def _detach(self, path: str):
+        if self.paths.pop(path, None) is None:
+            return
+        kept = [
+            (chunk, terms)
+            for chunk, terms in zip(self.chunks, self.terms)
+            if chunk[0] != path
+        ]
+        for chunk, terms in zip(self.chunks, self.terms):
+            if chunk[0] == path:
+                self.df.subtract(terms.keys())
+        self.df = +self.df
+        self.chunks = [chunk for chunk, _ in kept]
+        self.terms = [terms for _, terms in kept]
+
+
+def _terms(text: str) -> list[str]:
+    return _terms_re.findall(text.lower())
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import os
+import sys
+import traceback
+
+from .agents import AsyncClient, Client, image_files
+from .cache import open_cache
+from .configure import Configure
+
+config = Configure()
+
+
+def ocr(args):
+    model_cfg = (
+        config.find_model(args.model) if args.model else config.default_cli_ocr_model()
+    )
+    files = image_files(_ocr_inputs(args.files))
+    if not files:
+        print("Error: no file to OCR")
+        return
+    if len(files) > 1 or args.output:
+        return asyncio.run(ocr_batch(args, model_cfg, files))
+
+    client = Client.from_config(model_cfg, **_ocr_options(args.no_cache))
+    result = None
+
+    try:
+        result = client.ocr(files[0])
+    except Exception as e:
+        print(f"Fail to OCR: {e}")
+        traceback.print_exc()
+    _report_upload(client)
+
+    try:
+        js = json.loads(result)
+        print(f"{js['abstract']}\n\n{js['full']}")
+    except Exception as e:
+        print(f"Fail to parse as json: {e}\n\n{result}")
+        traceback.print_exc()
+
+
+async def ocr_batch(args, model_cfg: dict, files: list[str]):
+    done = _ocr_done(args.output) if args.output else set()
+    pending = asyncio.Queue()
+    for file in files:
+        if file not in done:
+            pending.put_nowait(file)
+
+    client = AsyncClient.from_config(model_cfg, **_ocr_options(args.no_cache))
+    out = open(args.output, "a") if args.output else sys.stdout
+
+    async def worker():
+        while not pending.empty():
+            file = pending.get_nowait()
+            record = await _ocr_one(client, file, args.retries)
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+    try:
+        await asyncio.gather(*[worker() for _ in range(max(1, args.jobs))])
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        _report_upload(client)
+
+
+def _ocr_options(no_cache: bool) -> dict:
+    max_bytes = None if no_cache else config.response_cache()
+    return {"cache": open_cache(max_bytes), "image": config.ocr_image()}
+
+
+def _report_upload(client: Client):
+    original, sent = client.uploaded["original"], client.uploaded["sent"]
+    if original:
+        print(
+            f"uploaded {sent >> 10} KiB of {original >> 10} KiB original",
+            file=sys.stderr,
+        )
+
+
+async def _ocr_one(client: AsyncClient, file: str, retries: int) -> dict:
+    error = None
+    for attempt in range(retries + 1):
+        try:
+            js = json.loads(await client.ocr(file))
+            return {
+                "file": file,
+                "abstract": js["abstract"],
+                "full": js["full"],
+                "error": None,
+            }
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if attempt < retries:
+                await asyncio.sleep(min(2**attempt, 30))
+    return {"file": file, "abstract": None, "full": None, "error": error}
+
+
+def _ocr_inputs(files: list[str]) -> list[str]:
+    inputs = []
+    for file in files:
+        if file == "-":
+            inputs.extend(line.strip() for line in sys.stdin if line.strip())
+        else:
+            inputs.append(file)
+    return inputs
+
+
+def _ocr_done(output: str) -> set[str]:
+    done = set()
+    if os.path.exists(output):
+        with open(output, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not record.get("error"):
+                    done.add(record["file"])
+    return done
@@ -1,10 +1,17 @@
-from markdown_it import MarkdownIt
+import asyncio
+import re
+import time
+
+from rich.columns import Columns
 from rich.console import Console
 from rich.live import Live
 from rich.markdown import Markdown, TextElement
+from rich.panel import Panel
 from rich.text import Text
 from rich.theme import Theme
 
+from . import telemetry
+
 
 class MyHeading(TextElement):
     @classmethod
@@ -60,56 +67,235 @@ def render_md_full(string):
 
 
 def render_md_stream(strings) -> str:
-    whole_string = ""
-    current_block = ""
-
-    def block_recognized():
-        nonlocal current_block
-        md = MarkdownIt("js-default")
-        tokens_len = 0
-        for char in _flatten_strings(strings):
-            current_block += char
-            tokens = md.parse(current_block)
-            new_block = (
-                tokens_len != len(tokens)
-                and current_block[-3:][:2] == "\n\n"
-                and char not in "-*123456789|"
-            )
-            tokens_len = len(tokens)
-            yield (char, new_block)
-
-    def new_live() -> Live:
-        live = Live(console=console, refresh_per_second=refresh_freq)
-        live.start()
-        return live
-
-    live = new_live()
-
-    for char, new_block in block_recognized():
-        if new_block:
-            current_block = char
-            live.stop()
-            console.print("")
-            live = new_live()
+    stream = _MdStream()
+    for delta in _deltas(strings):
+        stream.feed(delta)
+    return stream.close()
 
-        whole_string += char
-        live.update(Markdown(current_block))
 
-    live.stop()
-
-    return whole_string
+async def render_md_stream_async(strings) -> str:
+    stream = _MdStream()
+    async for delta in strings:
+        if delta:
+            stream.feed(delta)
+    return stream.close()
 
 
 def render_sys_stream(strings) -> str:
-    whole_string = ""
-    with Live(console=console, refresh_per_second=refresh_freq) as live:
-        for char in _flatten_strings(strings):
-            whole_string += char
-            live.update(Text(whole_string, "bright_black"))
-    return whole_string
+    frame = _Frame(_sys_text)
+    with Live(console=console, refresh_per_second=refresh_freq, get_renderable=frame):
+        for delta in _deltas(strings):
+            frame.append(delta)
+    return frame.text()
+
+
+async def render_sys_stream_async(strings) -> str:
+    frame = _Frame(_sys_text)
+    with Live(console=console, refresh_per_second=refresh_freq, get_renderable=frame):
+        async for delta in strings:
+            if delta:
+                frame.append(delta)
+    return frame.text()
+
+
+async def render_panes_async(streams: dict, caption) -> dict[str, str]:
+    frames = {title: _Frame(Markdown) for title in streams}
+
+    def panes():
+        return Columns(
+            [
+                Panel(frame(), title=title, subtitle=caption(title))
+                for title, frame in frames.items()
+            ],
+            equal=True,
+            expand=True,
+        )
+
+    async def pump(title, strings):
+        try:
+            async for delta in strings:
+                if delta:
+                    frames[title].append(delta)
+        except Exception as e:
+            frames[title].append(f"\n\nError: {e}")
+
+    with Live(console=console, refresh_per_second=refresh_freq, get_renderable=panes):
+        await asyncio.gather(*[pump(title, s) for title, s in streams.items()])
+    return {title: frame.text() for title, frame in frames.items()}
+
+
+def _sys_text(string):
+    return Text(string, "bright_black")
+
+
+class _MdStream:
+    def __init__(self):
+        self.whole_string = []
+        self.detector = _BlockDetector()
+        self.busy = 0.0
+        self.lag = 0.0
+        self._new_live()
+
+    def feed(self, delta):
+        started = time.perf_counter()
+        self._feed(delta)
+        spent = time.perf_counter() - started
+        self.busy += spent
+        self.lag = max(self.lag, spent)
+
+    def _feed(self, delta):
+        self.whole_string.append(delta)
+        start = 0
+        for split in self.detector.feed(delta):
+            self.frame.append(delta[start:split])
+            start = split
+            self.live.stop()
+            console.print("")
+            self._new_live()
+        self.frame.append(delta[start:])
+
+    def close(self) -> str:
+        self.live.stop()
+        telemetry.record("render", "markdown", busy=self.busy, lag=self.lag)
+        return "".join(self.whole_string)
+
+    def _new_live(self):
+        self.frame = _Frame(Markdown)
+        self.live = Live(
+            console=console, refresh_per_second=refresh_freq, get_renderable=self.frame
+        )
+        self.live.start()
 
 
-def _flatten_strings(strings):
+def _deltas(strings):
+    if isinstance(strings, str):
+        strings = [strings]
     for string in strings:
-        for char in string:
-            yield char
+        if string:
+            yield string
+
+
+class _Frame:
+    def __init__(self, build):
+        self.build = build
+        self.parts = []
+        self.dirty = False
+        self.renderable = ""
+
+    def append(self, string):
+        self.parts.append(string)
+        self.dirty = True
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def __call__(self):
+        if self.dirty:
+            self.dirty = False
+            self.renderable = self.build(self.text())
+        return self.renderable
+
+
+_fence_re = re.compile(r"^( *)(`{3,}|~{3,})(.*)$")
+_list_item_re = re.compile(r"^(\s*(?:[-*+]|(\d+)[.)]))(\s+|$)")
+_block_start_re = re.compile(r"^(?:[>#`~]|(?:[-*_]\s*){3,}$)")
+# lines after which a list item never counts as interrupting a paragraph
+_leaf_re = re.compile(r"^(?:>|#{1,6}(?:\s|$)|(?:[-*_]\s*){3,}$)")
+
+
+class _BlockDetector:
+    def __init__(self):
+        self.tail = ""
+        self.line = []
+        self.line_started = False
+        self.fence = None
+        self.list_indent = 0
+        self.blank = True
+        self.paragraph = False
+        self.empty_item = False
+
+    def feed(self, string) -> list[int]:
+        return [i for i, char in enumerate(string) if self._feed_char(char)]
+
+    def _feed_char(self, char) -> bool:
+        if (
+            self.fence
+            and not self.line_started
+            and not char.isspace()
+            and len(self.line) < self.fence[1]
+        ):
+            self.fence = None
+            self.blank = True
+
+        new_block = (
+            self.fence is None
+            and self.tail == "\n\n"
+            and not char.isspace()
+            and char not in "-*123456789|"
+        )
+        self.tail = char if new_block else (self.tail + char)[-2:]
+
+        if char == "\n":
+            self._line_ended("".join(self.line))
+            self.line.clear()
+            self.line_started = False
+        else:
+            self.line.append(char)
+            self.line_started = self.line_started or not char.isspace()
+
+        return new_block
+
+    def _line_ended(self, line):
+        # tabs stop at multiples of four, as in CommonMark
+        line = line.expandtabs(4)
+        stripped = line.strip()
+        indent = len(line) - len(line.lstrip())
+        after_blank, self.blank = self.blank, not stripped
+        in_paragraph, self.paragraph = self.paragraph, bool(stripped)
+        empty_item, self.empty_item = self.empty_item, False
+
+        if self.fence is not None:
+            marker, nested = self.fence
+            if (
+                indent <= nested + 3
+                and stripped.startswith(marker)
+                and stripped == marker[0] * len(stripped)
+            ):
+                self.fence = None
+            return
+
+        match = _list_item_re.match(line)
+        if match and in_paragraph and indent >= self.list_indent:
+            # a list interrupts a paragraph at its own indent only with a
+            # non-empty item, and an ordered one only when it starts at 1
+            empty = stripped == match[1].strip()
+            if empty or match[2] not in (None, "1"):
+                match = None
+        if match:
+            marker, _, spaces = match.groups()
+            self.empty_item = stripped == marker.strip()
+            self.paragraph = not self.empty_item
+            self.list_indent = len(marker) + (len(spaces) if not self.empty_item else 1)
+        elif not stripped:
+            # an item that starts empty ends at the first blank line
+            if empty_item:
+                self.list_indent = 0
+        elif indent < self.list_indent and not in_paragraph:
+            # outdented and not a lazy paragraph line, so the list has ended
+            self.list_indent = 0
+        elif indent == 0 and (after_blank or _block_start_re.match(stripped)):
+            self.list_indent = 0
+
+        if _leaf_re.match(stripped) and not match:
+            self.paragraph = False
+
+        if match := _fence_re.match(line):
+            self.paragraph = False
+            spaces, marker, info = match.groups()
+            if marker[0] == "`" and "`" in info:
+                return
+            nested = self.list_indent if 0 < self.list_indent <= len(spaces) else 0
+            # four or more spaces past the container is an indented code block
+            if len(spaces) > nested + 3:
+                return
+            self.fence = (marker, nested)
@@ -0,0 +1,194 @@
+import asyncio
+import random
+import time
+
+from .agents import AsyncClient
+
+_continue_prompt = (
+    "Your previous answer was cut off. Continue exactly where it stopped, "
+    "without repeating anything."
+)
+
+# endpoint name -> health, shared by every router so switches keep the history
+_health: dict[str, "Health"] = {}
+
+
+class Stalled(Exception):
+    pass
+
+
+class Health:
+    def __init__(self):
+        self.latency = None
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    def succeeded(self, latency: float):
+        if self.latency is not None:
+            latency = 0.7 * self.latency + 0.3 * latency
+        self.latency = latency
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    def failed(self):
+        self.failures += 1
+        self.cooldown_until = time.monotonic() + min(2**self.failures, 60)
+
+    def score(self) -> tuple:
+        latency = self.latency if self.latency is not None else float("inf")
+        return (self.cooldown_until > time.monotonic(), latency)
+
+
+class Router:
+    def __init__(
+        self,
+        clients: list[AsyncClient],
+        retries: int = 2,
+        first_token_timeout: float | None = 60,
+        chunk_timeout: float | None = 30,
+    ):
+        self.clients = clients
+        self.retries = retries
+        self.first_token_timeout = first_token_timeout
+        self.chunk_timeout = chunk_timeout
+
+    @property
+    def name(self) -> str:
+        return self.clients[0].name
+
+    async def warm(self):
+        await self.clients[0].warm()
+
+    async def stream_response(
+        self,
+        messages: list[dict],
+        json: bool = False,
+        cache: bool = False,
+        tools: list | None = None,
+    ) -> "RoutedResponse":
+        options = {"json": json, "cache": cache, "tools": tools}
+        return RoutedResponse(self, messages, options)
+
+    def candidates(self) -> list[AsyncClient]:
+        # unmeasured endpoints tie and keep the configured order, so the primary
+        # is used until it fails or a fallback has proven faster
+        return sorted(self.clients, key=lambda c: health(c.name).score())
+
+
+class RoutedResponse:
+    def __init__(self, router: Router, messages: list[dict], options: dict):
+        self.router = router
+        self.messages = messages
+        self.options = options
+        self.tool_calls = {}
+        self.usage = None
+        self.client = None
+        self.attempts = []
+
+    async def __aiter__(self):
+        parts = []
+        for attempt in range(self.router.retries + 1):
+            if attempt:
+                await asyncio.sleep(min(2**attempt, 30) * random.uniform(0.5, 1.5))
+            for client in self.router.candidates():
+                messages = self.messages
+                if parts:
+                    messages = messages + [
+                        {"role": "assistant", "content": "".join(parts)},
+                        {"role": "user", "content": _continue_prompt},
+                    ]
+                started = time.monotonic()
+                try:
+                    response = await client.stream_response(messages, **self.options)
+                    first = True
+                    async for delta in _timed(response, self.router, started):
+                        if first:
+                            health(client.name).succeeded(time.monotonic() - started)
+                            first = False
+                        parts.append(delta)
+                        yield delta
+                    if first:
+                        health(client.name).succeeded(time.monotonic() - started)
+                except Exception as e:
+                    if not _retryable(e):
+                        raise
+                    health(client.name).failed()
+                    self.attempts.append((client.name, f"{type(e).__name__}: {e}"))
+                    continue
+                self.client = client
+                self.tool_calls = response.tool_calls
+                self.usage = response.usage
+                return
+        name, error = self.attempts[-1]
+        raise RuntimeError(f"all endpoints failed, last {name}: {error}")
+
+
+def health(name: str) -> Health:
+    if name not in _health:
+        _health[name] = Health()
+    return _health[name]
+
+
+async def _timed(response, router: Router, started: float):
+    last = [time.monotonic(), router.first_token_timeout]
+
+    def heartbeat():
+        last[:] = [time.monotonic(), router.chunk_timeout]
+
+    response.heartbeat = heartbeat
+    chunks = aiter(response)
+    try:
+        while True:
+            pending = asyncio.ensure_future(anext(chunks))
+            while not pending.done():
+                beat, timeout = last
+                remaining = (
+                    None if timeout is None else beat + timeout - time.monotonic()
+                )
+                if remaining is not None and remaining <= 0:
+                    pending.cancel()
+                    elapsed = time.monotonic() - started
+                    raise Stalled(
+                        f"no data for {timeout}s, {elapsed:.1f}s into request"
+                    )
+                await asyncio.wait([pending], timeout=remaining)
+            try:
+                delta = pending.result()
+            except StopAsyncIteration:
+                return
+            if delta:
+                yield delta
+    finally:
+        if stream := getattr(response, "stream", None):
+            try:
+                await stream.close()
+            except Exception:
+                pass
+
+
+def _retryable(e: Exception) -> bool:
+    import openai
+
+    if isinstance(
+        e,
+        (
+            Stalled,
+            openai.APIConnectionError,
+            openai.APITimeoutError,
+            openai.RateLimitError,
+            openai.InternalServerError,
+        ),
+    ):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    # mid-stream SSE errors are not wrapped in a status
+    if isinstance(e, openai.APIError):
+        return True
+    # a stream cut mid-read surfaces the transport error unwrapped, and httpx
+    # is only a transitive dependency of openai
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(e, httpx.TransportError)
@@ -0,0 +1,135 @@
+import atexit
+import os
+import sqlite3
+
+db_path = os.path.expanduser("~/.azx/search.db")
+
+# bumped when what gets indexed changes, so older databases are rebuilt once
+_version = "2"
+
+_conn = None
+# rows added since the last flush, indexed in one transaction off the write path
+_pending = []
+
+
+def add(started_at: str, at: str, role: str, content: str):
+    if not _pending:
+        atexit.register(flush)
+    _pending.append((started_at, at, role, content))
+
+
+def flush():
+    if not _pending:
+        return
+    atexit.unregister(flush)
+    rows = _pending[:]
+    _pending.clear()
+    add_many(rows)
+
+
+def add_many(rows):
+    db = _db()
+    if db is None:
+        return
+    db.executemany(
+        "INSERT INTO messages (started_at, at, role, content) VALUES (?, ?, ?, ?)",
+        rows,
+    )
+    db.commit()
+
+
+def built() -> bool:
+    flush()
+    db = _db()
+    if db is None:
+        return True
+    row = db.execute("SELECT value FROM meta WHERE key = 'built'").fetchone()
+    return row is not None and row[0] == _version
+
+
+def rebuild(rows):
+    db = _db()
+    if db is None:
+        return
+    db.execute("DELETE FROM messages")
+    add_many(rows)
+    db.execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES ('built', ?)", (_version,)
+    )
+    db.commit()
+
+
+def find(terms: str, limit: int = 20) -> list[tuple[str, str]]:
+    flush()
+    db = _db()
+    words = terms.split()
+    if db is None or not words:
+        return []
+
+    # trigram tokens need 3+ characters, shorter words fall back to a scan
+    long = [w for w in words if len(w) >= 3]
+    short = [w.lower() for w in words if len(w) < 3]
+
+    where = ["instr(lower(content), ?) > 0" for _ in short]
+    params = list(short)
+    if long:
+        where.insert(0, "messages MATCH ?")
+        params.insert(0, " ".join('"' + w.replace('"', '""') + '"' for w in long))
+
+    snippet = "snippet(messages, 3, '**', '**', '…', 32)" if long else "NULL"
+    order = "rank" if long else "at DESC"
+    rows = db.execute(
+        f"SELECT started_at, content, {snippet} FROM messages "
+        f"WHERE {' AND '.join(where)} ORDER BY {order}",
+        params,
+    )
+
+    hits = {}
+    for started_at, content, excerpt in rows:
+        if started_at in hits:
+            continue
+        # excerpts show as one list item each, so newlines are collapsed
+        hits[started_at] = " ".join((excerpt or _excerpt(content, short[0])).split())
+        if len(hits) == limit:
+            break
+
+    return list(hits.items())
+
+
+def _excerpt(content: str, word: str, width: int = 40) -> str:
+    at = content.lower().find(word)
+    start = max(at - width, 0)
+    end = at + len(word) + width
+    return (
+        ("…" if start > 0 else "")
+        + content[start:at]
+        + f"**{content[at : at + len(word)]}**"
+        + content[at + len(word) : end]
+        + ("…" if end < len(content) else "")
+    )
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        try:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            conn = sqlite3.connect(db_path)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5("
+                "started_at UNINDEXED, at UNINDEXED, role UNINDEXED, content, "
+                "tokenize = 'trigram')"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            _conn = conn
+        except sqlite3.Error as e:
+            # reported once, later calls see the index as missing
+            _conn = False
+            from .renderer import render_error
+
+            render_error(f"Search index unavailable: {e}")
+    return _conn or None
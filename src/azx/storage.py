@@ -2,17 +2,34 @@ import datetime
 import json
 import os
 import re
+import time
+
+from . import search, telemetry
 
 base_dir = os.path.expanduser("~/.azx")
+catalog_path = os.path.join(base_dir, "catalog.jsonl")
+
+# the catalog only needs enough of the first question to describe the session
+question_chars = 200
 
 
 class Store:
-    def __init__(self):
+    def __init__(self, fsync_interval: float | None = None):
         self.started_at = _now_str()
         self.ended_at = self.started_at
         self.progress = 0
         self.conversation = []
+        # log offset of the record behind each conversation message, None for notes
+        self.origins = []
         self.usage = 0
+        self.last_sum = None
+        self.question = None
+        self.cursor = 0
+        self.fsync_interval = fsync_interval
+        self.synced_at = time.monotonic()
+        self.file = None
+        # the catalog entry last appended, compared to skip appending on every record
+        self.cataloged = None
 
     def tool(self, id: str, name: str, args: str, ret: dict):
         self._add_tool_to_last_assistant_msg(id, name, args)
@@ -26,153 +43,275 @@ class Store:
             }
         )
 
-        status = ret["status"]
-        msg = ret["message"]
-
-        os.makedirs(self._loc(), exist_ok=True)
-        with open(self._log_path("tool"), "w") as f:
-            f.write("\n".join([id, name, args, status, msg]))
+        offset = self._append(
+            {
+                "at": self.ended_at,
+                "role": "tool",
+                "id": id,
+                "name": name,
+                "args": args,
+                "status": ret["status"],
+                "message": ret["message"],
+            }
+        )
+        self.origins.append(offset)
 
     def log(self, role: str, msg: str):
         self.ended_at = _now_str()
         self.conversation.append({"role": role, "content": msg})
-
-        os.makedirs(self._loc(), exist_ok=True)
-        with open(self._log_path(role), "w") as f:
-            f.write(msg)
+        if role == "user" and self.question is None:
+            self.question = msg
+        self.origins.append(
+            self._append({"at": self.ended_at, "role": role, "content": msg})
+        )
 
     def summary(self, sum: str):
-        with open(os.path.join(self._loc(), f"{self.ended_at}.sum.md"), "w") as f:
-            f.write(sum)
-
-    def note(self, msg: str):
-        self._note(msg)
-        self.ended_at = _now_str()
-        os.makedirs(self._loc(), exist_ok=True)
-        with open(self._log_path("note"), "w") as f:
-            f.write(msg)
+        self.last_sum = sum
+        self._append({"at": self.ended_at, "role": "summary", "content": sum})
+
+    def note(self, msg: str, keep: int = 0):
+        keep = min(keep, len(self.conversation))
+        record = {"at": _now_str(), "role": "note", "content": msg}
+        if keep and (start := self.origins[-keep]) is not None:
+            record |= {"keep": keep, "from": start}
+        self._note(msg, keep)
+        self.ended_at = record["at"]
+        self._append(record)
+
+    def flush(self):
+        self._catalog_sync(force=True)
+        search.flush()
 
     def compaction(self) -> list:
+        return self.conversation + [self._compaction_prompt()]
+
+    def rolling_compaction(self, keep_turns: int) -> tuple[list, int] | None:
+        users = [i for i, msg in enumerate(self.conversation) if msg["role"] == "user"]
+        if len(users) <= keep_turns or users[-keep_turns] <= 1:
+            return None
+        cut = users[-keep_turns]
+        return self.conversation[:cut] + [self._compaction_prompt()], cut
+
+    def fold(self, msg: str, cut: int, head: dict):
+        if not self.conversation or self.conversation[0] is not head:
+            return
+        self.note(msg, len(self.conversation) - cut)
+
+    def _compaction_prompt(self) -> dict:
         schema = '{"Q&A": [{"question": "xxx", "answer": "xxx"}], "resources": [{"uri": "xxx", content: "xxx"}]}'
         prompt = (
             f"简明地总结上述对话（包括前情和新的对话）：1、里面提出了什么问题，得到了什么答案，并尽量整合多个相关的问答为一个问答；2、使用了什么文件或网址，它们涉及什么内容。以JSON格式回复：`{schema}`"
             if self._chinese()
             else f"Briefly summarize the above conversation (including previous context and new dialogue): 1. What questions were raised and what answers were obtained, integrating multiple related Q&As into consolidated pairs; 2. What files or URLs were used and what content they involved. Reply in JSON format: `{schema}`"
         )
-        return self.conversation + [{"role": "user", "content": prompt}]
+        return {"role": "user", "content": prompt}
 
     def sum_or_quest(self):
-        def last_summary():
-            files = [
-                f
-                for f in os.listdir(self._loc())
-                if os.path.isfile(os.path.join(self._loc(), f)) and f.endswith("sum.md")
-            ]
-
-            if not files:
-                return ""
-
-            files.sort()
+        return self.last_sum or self.question or "nothing"
 
-            with open(os.path.join(self._loc(), files[-1]), "r") as f:
-                return f.read().strip()
-
-        def first_question():
-            for speak in self.conversation:
-                if speak["role"] == "user":
-                    return speak["content"]
-
-        return last_summary() or first_question() or "nothing"
+    def catalog_entry(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+            "messages": self.progress,
+            "summary": self.last_sum,
+            "question": self.question and self.question[:question_chars],
+        }
 
     def resume(self, started_at: str):
         self.started_at = started_at
-
-        dir_path = self._loc()
-        if not os.path.exists(dir_path):
+        entry = None
+
+        if os.path.exists(self._log_file()):
+            entry = _catalog()[0].get(started_at)
+            if entry:
+                records = self._tail_records()
+            else:
+                with open(self._log_file(), "rb") as f:
+                    records = list(_lines(f))
+        else:
+            records = []
+            offset = 0
+            for record in _legacy_records(self._loc()):
+                records.append((offset, record))
+                offset += len(_dump(record).encode())
+            if records:
+                with open(self._log_file(), "w") as f:
+                    f.writelines(_dump(r) for _, r in records)
+
+        if not records:
             return
 
-        files = [
-            f
-            for f in os.listdir(dir_path)
-            if os.path.isfile(os.path.join(dir_path, f))
-            and (
-                f.endswith("user.md")
-                or f.endswith("system.md")
-                or f.endswith("assistant.md")
-                or f.endswith("tool.md")
-                or f.endswith("note.md")
-            )
-        ]
-        files.sort()
-
-        if not files:
-            return
-
-        self.ended_at = os.path.basename(files[-1]).split(".")[0]
-        self.progress = len(files)
+        self.progress = len(records)
         self.conversation.clear()
-
-        for filename in files:
-            file_path = os.path.join(dir_path, filename)
-            try:
-                with open(file_path, "r") as f:
-                    segments = filename.split(".")
-                    role = segments[-2]
-                    if role == "tool":
-                        fn_id = f.readline().strip()
-                        fn_name = f.readline().strip()
-                        fn_args = f.readline().strip()
-                        fn_status = f.readline().strip()
-                        fn_msg = f.read().strip()
-                        content = {"status": fn_status, "message": fn_msg}
-                        self._add_tool_to_last_assistant_msg(fn_id, fn_name, fn_args)
-                        self.conversation.append(
-                            {
-                                "role": role,
-                                "tool_call_id": fn_id,
-                                "name": fn_name,
-                                "content": json.dumps(content),
-                            }
-                        )
-                    elif role == "note":
-                        self._note(f.read().strip())
-                    else:
-                        self.conversation.append(
-                            {"role": role, "content": f.read().strip()}
-                        )
-            except Exception:
+        self.origins.clear()
+
+        self.cataloged = entry
+        if entry:
+            self.progress = entry["messages"]
+            self.last_sum = entry["summary"]
+            self.question = entry["question"]
+
+        for offset, record in records:
+            role = record["role"]
+            if role == "summary":
+                self.last_sum = record["content"]
                 continue
 
-    def _note(self, msg):
+            self.ended_at = record["at"]
+            if role == "user" and self.question is None:
+                self.question = record["content"]
+
+            if role == "tool":
+                content = {"status": record["status"], "message": record["message"]}
+                self._add_tool_to_last_assistant_msg(
+                    record["id"], record["name"], record["args"]
+                )
+                self.conversation.append(
+                    {
+                        "role": role,
+                        "tool_call_id": record["id"],
+                        "name": record["name"],
+                        "content": json.dumps(content),
+                    }
+                )
+                self.origins.append(offset)
+            elif role == "note":
+                keep = (
+                    self._kept_since(record["from"])
+                    if "from" in record
+                    else record.get("keep", 0)
+                )
+                self._note(record["content"], keep)
+            else:
+                self.conversation.append({"role": role, "content": record["content"]})
+                self.origins.append(offset)
+
+    def earlier(self, limit: int) -> list[dict]:
+        if self.cursor == 0:
+            return []
+
+        records = []
+        with open(self._log_file(), "rb") as f:
+            for offset, line in _reverse_lines(f, self.cursor):
+                records.append(json.loads(line))
+                self.cursor = offset
+                if len(records) == limit:
+                    break
+            else:
+                self.cursor = 0
+
+        records.reverse()
+        return records
+
+    def _tail_records(self) -> list[tuple[int, dict]]:
+        records = []
+        note = None
+        wanted = None
+        with open(self._log_file(), "rb") as f:
+            for offset, line in _reverse_lines(f, f.seek(0, os.SEEK_END)):
+                record = json.loads(line)
+                records.append((offset, record))
+                self.cursor = offset
+                if note is None and record["role"] == "note":
+                    note = record
+                    # notes written before the "from" anchor only know a count
+                    wanted = None if "from" in note else note.get("keep", 0)
+                elif wanted is not None and record["role"] not in ("summary", "note"):
+                    wanted -= 1
+                if note is not None and (
+                    wanted == 0 or ("from" in note and offset <= note["from"])
+                ):
+                    break
+            else:
+                self.cursor = 0
+
+        records.reverse()
+        return records
+
+    def _kept_since(self, start: int) -> int:
+        keep = 0
+        for origin in reversed(self.origins):
+            if origin is None or origin < start:
+                break
+            keep += 1
+        return keep
+
+    def _note(self, msg, keep=0):
         content = (
             f"前情提要：\n\n{msg}\n\n现在我们继续……"
-            if self._chinese()
+            if self._chinese(msg)
             else f"Previously:\n\n{msg}\n\nNow we continue ..."
         )
+        keep = min(keep, len(self.conversation))
+        kept = self.conversation[len(self.conversation) - keep :] if keep else []
+        origins = self.origins[len(self.origins) - keep :] if keep else []
         self.conversation.clear()
         self.conversation.append({"role": "system", "content": content})
+        self.conversation.extend(kept)
+        self.origins[:] = [None] + origins
+
+    def _chinese(self, fallback: str = "") -> bool:
+        qa = [
+            c["content"]
+            for c in self.conversation
+            if c["role"] in ["user", "assistant"]
+        ]
+        qa = qa or [fallback]
 
-    def _chinese(self) -> bool:
-        def qa():
-            for c in self.conversation:
-                if c["role"] in ["user", "assistant"]:
-                    yield c["content"]
-
-        cn = sum(len(re.findall(r"[\u4e00-\u9fff]", c)) for c in qa())
-        tot = sum(len(c) for c in qa())
-        return (cn / tot) > 0.5
+        cn = sum(len(re.findall(r"[\u4e00-\u9fff]", c)) for c in qa)
+        tot = sum(len(c) for c in qa)
+        return tot > 0 and (cn / tot) > 0.5
 
     def __str__(self):
-        return f"**{self.started_at}** ~ **{self.ended_at}**: {self.sum_or_quest()}"
+        return _describe(self.catalog_entry())
 
     def _loc(self) -> str:
         return os.path.join(base_dir, self.started_at)
 
-    def _log_path(self, role) -> str:
-        file_name = f"{self.ended_at}.{self.progress}.{role}.md"
-        full_path = os.path.join(self._loc(), file_name)
+    def _log_file(self) -> str:
+        return os.path.join(self._loc(), "session.jsonl")
+
+    def _append(self, record: dict) -> int:
+        with telemetry.timer("store", "append"):
+            return self._write(record)
+
+    def _write(self, record: dict) -> int:
+        if self.file is None:
+            os.makedirs(self._loc(), exist_ok=True)
+            self.file = open(self._log_file(), "ab")
+        offset = self.file.tell()
+        self.file.write(_dump(record).encode())
+        self.file.flush()
         self.progress += 1
-        return full_path
+        self._catalog_sync()
+        # the system prompt opens every session, so it is left out of the index
+        if record["role"] != "system":
+            search.add(
+                self.started_at, record["at"], record["role"], _searchable(record)
+            )
+
+        if (
+            self.fsync_interval is not None
+            and time.monotonic() - self.synced_at >= self.fsync_interval
+        ):
+            os.fsync(self.file.fileno())
+            self.synced_at = time.monotonic()
+        return offset
+
+    def _catalog_sync(self, force: bool = False):
+        # summary and question show in history right away, counts and times
+        # are caught up on flush
+        entry = self.catalog_entry()
+        last = self.cataloged
+        if (
+            last is None
+            or entry["summary"] != last["summary"]
+            or entry["question"] != last["question"]
+            or (force and entry != last)
+        ):
+            _catalog_append(entry)
+            self.cataloged = entry
 
     def _add_tool_to_last_assistant_msg(self, id, name, args):
         last_msg = next(
@@ -192,28 +331,175 @@ class Store:
         )
 
 
+def _dump(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def _lines(f):
+    offset = 0
+    for line in f:
+        if line.strip():
+            yield offset, json.loads(line)
+        offset += len(line)
+
+
+def _reverse_lines(f, end: int, block: int = 1 << 16):
+    pos = end
+    rest = b""
+    while pos > 0:
+        step = min(block, pos)
+        pos -= step
+        f.seek(pos)
+        lines = (f.read(step) + rest).split(b"\n")
+        rest = lines[0]
+        offsets = []
+        offset = pos + len(rest) + 1
+        for line in lines[1:]:
+            offsets.append(offset)
+            offset += len(line) + 1
+        for offset, line in reversed(list(zip(offsets, lines[1:]))):
+            if line.strip():
+                yield offset, line
+    if rest.strip():
+        yield 0, rest
+
+
+def _session_records(started_at: str) -> list[dict]:
+    log_file = os.path.join(base_dir, started_at, "session.jsonl")
+    if not os.path.exists(log_file):
+        return _legacy_records(os.path.join(base_dir, started_at))
+    with open(log_file, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _searchable(record: dict) -> str:
+    if record["role"] == "tool":
+        return f"{record['name']}({record['args']})\n{record['message']}"
+    return record["content"]
+
+
+def _legacy_records(dir_path: str) -> list[dict]:
+    if not os.path.exists(dir_path):
+        return []
+
+    roles = ("user", "system", "assistant", "tool", "note", "sum")
+    files = []
+    for f in os.listdir(dir_path):
+        segments = f.split(".")
+        if segments[-1] != "md" or segments[-2] not in roles:
+            continue
+        progress = int(segments[1]) if len(segments) == 4 else float("inf")
+        files.append((segments[0], progress, segments[-2], f))
+    files.sort()
+
+    records = []
+    for at, _, role, filename in files:
+        try:
+            with open(os.path.join(dir_path, filename), "r") as f:
+                if role == "tool":
+                    records.append(
+                        {
+                            "at": at,
+                            "role": role,
+                            "id": f.readline().strip(),
+                            "name": f.readline().strip(),
+                            "args": f.readline().strip(),
+                            "status": f.readline().strip(),
+                            "message": f.read().strip(),
+                        }
+                    )
+                else:
+                    role = "summary" if role == "sum" else role
+                    records.append(
+                        {"at": at, "role": role, "content": f.read().strip()}
+                    )
+        except Exception:
+            continue
+
+    return records
+
+
 def _now_str() -> str:
     return datetime.datetime.now().strftime("%Y_%m%d_%H%M%S")
 
 
+def _describe(entry: dict) -> str:
+    sum_or_quest = entry["summary"] or entry["question"] or "nothing"
+    return f"**{entry['started_at']}** ~ **{entry['ended_at']}**: {sum_or_quest}"
+
+
+def _catalog_append(entry: dict):
+    with open(catalog_path, "a") as f:
+        f.write(_dump(entry))
+
+
+def _catalog() -> tuple[dict[str, dict], int]:
+    entries = {}
+    lines = 0
+    if os.path.exists(catalog_path):
+        with open(catalog_path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry["started_at"]] = entry
+                lines += 1
+    return entries, lines
+
+
 def history() -> str:
-    if not os.path.exists(base_dir):
-        return "No history found."
+    items = [f"{i + 1}. {_describe(entry)}" for i, entry in enumerate(_sessions())]
+
+    return "\n".join(items) if items else "No history found."
 
-    def resume(started_at: str) -> Store:
-        store = Store()
-        store.resume(started_at)
-        return store
 
-    stores = [
-        resume(item)
-        for item in os.listdir(base_dir)
-        if os.path.isdir(os.path.join(base_dir, item))
-        and re.match(r"^\d{4}_\d{4}_\d{6}$", item)
+def search_history(terms: str) -> str:
+    sessions = _sessions()
+
+    if not search.built():
+        search.rebuild(
+            (entry["started_at"], record["at"], record["role"], _searchable(record))
+            for entry in sessions
+            for record in _session_records(entry["started_at"])
+            if record["role"] != "system"
+        )
+
+    numbers = {entry["started_at"]: i + 1 for i, entry in enumerate(sessions)}
+    items = [
+        f"{numbers[started_at]}. **{started_at}**: {excerpt}"
+        for started_at, excerpt in search.find(terms)
+        if started_at in numbers
     ]
 
-    stores.sort(key=lambda s: s.ended_at)
+    return "\n".join(items) if items else "Nothing found."
 
-    items = [f"{i + 1}. {store}" for i, store in enumerate(stores)]
 
-    return "\n".join(items) if items else "No history found."
+def _sessions() -> list[dict]:
+    if not os.path.exists(base_dir):
+        return []
+
+    entries, lines = _catalog()
+
+    sessions = [
+        item
+        for item in os.listdir(base_dir)
+        if re.match(r"^\d{4}_\d{4}_\d{6}$", item)
+        and os.path.isdir(os.path.join(base_dir, item))
+    ]
+
+    for started_at in sessions:
+        if started_at not in entries:
+            store = Store()
+            store.resume(started_at)
+            entries[started_at] = store.catalog_entry()
+            _catalog_append(entries[started_at])
+            lines += 1
+
+    entries = {k: entries[k] for k in sessions}
+    if lines > 2 * len(entries) + 64:
+        with open(catalog_path + ".tmp", "w") as f:
+            f.writelines(_dump(entry) for entry in entries.values())
+        os.replace(catalog_path + ".tmp", catalog_path)
+
+    return sorted(entries.values(), key=lambda e: e["ended_at"])
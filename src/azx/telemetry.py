@@ -0,0 +1,112 @@
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+metrics_path = os.path.expanduser("~/.azx/metrics.jsonl")
+
+max_bytes = 8 << 20
+backups = 3
+
+_session: list[dict] = []
+_file = None
+
+
+def record(kind: str, name: str, **values):
+    entry = {"at": time.time(), "kind": kind, "name": name} | {
+        k: v for k, v in values.items() if v is not None
+    }
+    _session.append(entry)
+    try:
+        _write(entry)
+    except OSError:
+        pass
+
+
+@contextmanager
+def timer(kind: str, name: str, **values):
+    started = time.perf_counter()
+    try:
+        yield values
+    finally:
+        record(kind, name, seconds=time.perf_counter() - started, **values)
+
+
+def stats(overall: bool = False) -> str:
+    rows = _quantiles(_history() if overall else _session)
+    if not rows:
+        return "No metrics yet."
+    lines = ["| kind | name | metric | n | p50 | p95 |", "|---|---|---|---|---|---|"]
+    for (kind, name, metric), (n, p50, p95) in sorted(rows.items()):
+        lines.append(f"| {kind} | {name} | {metric} | {n} | {p50:.3g} | {p95:.3g} |")
+    return "\n".join(lines)
+
+
+def export(path: str):
+    lines = [
+        "# HELP azx_metric Per kind and name quantiles of this azx session.",
+        "# TYPE azx_metric gauge",
+    ]
+    for (kind, name, metric), (n, p50, p95) in sorted(_quantiles(_session).items()):
+        labels = f'kind="{kind}",name="{_escape(name)}",metric="{metric}"'
+        lines.append(f'azx_metric{{{labels},quantile="0.5"}} {p50}')
+        lines.append(f'azx_metric{{{labels},quantile="0.95"}} {p95}')
+        lines.append(f"azx_metric_count{{{labels}}} {n}")
+    with open(path + ".tmp", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def _quantiles(entries: list[dict]) -> dict[tuple, tuple]:
+    values = defaultdict(list)
+    for entry in entries:
+        for metric, value in entry.items():
+            if metric in ("at", "kind", "name") or isinstance(value, bool):
+                continue
+            if isinstance(value, (int, float)):
+                values[(entry["kind"], entry["name"], metric)].append(value)
+    return {
+        key: (len(vs), _percentile(vs, 0.5), _percentile(vs, 0.95))
+        for key, vs in values.items()
+    }
+
+
+def _percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _write(entry: dict):
+    global _file
+    if _file is None:
+        os.makedirs(os.path.dirname(metrics_path), exist_ok=True)
+        _file = open(metrics_path, "a")
+    _file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    _file.flush()
+    if _file.tell() > max_bytes:
+        _file.close()
+        _file = None
+        for i in range(backups - 1, 0, -1):
+            if os.path.exists(f"{metrics_path}.{i}"):
+                os.replace(f"{metrics_path}.{i}", f"{metrics_path}.{i + 1}")
+        os.replace(metrics_path, f"{metrics_path}.1")
+
+
+def _history() -> list[dict]:
+    entries = []
+    paths = [f"{metrics_path}.{i}" for i in range(backups, 0, -1)] + [metrics_path]
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    return entries
+
+
+def _escape(label: str) -> str:
+    return label.replace("\\", "\\\\").replace('"', '\\"')
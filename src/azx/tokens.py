@@ -0,0 +1,66 @@
+import json
+import re
+
+_cjk = re.compile(
+    r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]"
+)
+
+
+class Estimator:
+    def __init__(self, ratio: float = 1.0):
+        self.ratio = ratio
+        self.error = None
+        self.cache = {}
+        self.tools = (None, 0, 0)
+
+    def raw(self, messages: list[dict], tools: list | None = None) -> int:
+        count = sum(self._message(msg) for msg in messages) + self._tools(tools)
+        self._prune(messages)
+        return count
+
+    def predict(self, raw: int) -> int:
+        return int(raw * self.ratio)
+
+    def calibrate(self, raw: int, actual: int) -> float:
+        if raw <= 0 or actual <= 0:
+            return self.error
+        self.error = (self.predict(raw) - actual) / actual
+        self.ratio = 0.7 * self.ratio + 0.3 * (actual / raw)
+        return self.error
+
+    def _message(self, msg: dict) -> int:
+        tool_calls = msg.get("tool_calls", [])
+        content = msg.get("content") or ""
+        key = (len(content), len(tool_calls))
+        cached = self.cache.get(id(msg))
+        if cached is not None and cached[0] is msg and cached[1] == key:
+            return cached[2]
+
+        count = 4 + text_tokens(content)
+        for call in tool_calls:
+            count += 8 + text_tokens(
+                call["function"]["name"] + call["function"]["arguments"]
+            )
+        self.cache[id(msg)] = (msg, key, count)
+        return count
+
+    def _tools(self, tools: list | None) -> int:
+        if not tools:
+            return 0
+        if self.tools[0] is not tools or self.tools[1] != len(tools):
+            self.tools = (
+                tools,
+                len(tools),
+                text_tokens(json.dumps(tools, ensure_ascii=False)),
+            )
+        return self.tools[2]
+
+    def _prune(self, messages: list[dict]):
+        if len(self.cache) > 2 * len(messages) + 64:
+            alive = {id(msg) for msg in messages}
+            self.cache = {k: v for k, v in self.cache.items() if k in alive}
+
+
+def text_tokens(string: str) -> int:
+    cjk = len(_cjk.findall(string))
+    return cjk + (len(string) - cjk + 3) // 4
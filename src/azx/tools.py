@@ -1,18 +1,80 @@
+import asyncio
+import importlib
 import inspect
+import json
+import time
+from collections import OrderedDict
 
-import yaml
-from fastmcp import Client
-from fastmcp.client.transports import StdioTransport
+from . import telemetry
 
 
 class LocalTools:
     definitions = []
 
 
+def tool_list_changed(callback):
+    # fastmcp is imported when the first server starts, not at startup
+    from fastmcp.client.messages import MessageHandler
+
+    class ToolListChanged(MessageHandler):
+        async def on_tool_list_changed(self, _notification):
+            callback()
+
+    return ToolListChanged()
+
+
+class ToolCache:
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[tuple, tuple[float, dict]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, server: str, name: str, params: dict) -> tuple:
+        return server, name, json.dumps(params, sort_keys=True, ensure_ascii=False)
+
+    def get(self, key: tuple) -> dict | None:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: tuple, ttl: float, result: dict):
+        self.entries[key] = (time.monotonic() + ttl, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def drop(self, server: str):
+        for key in [k for k in self.entries if k[0] == server]:
+            del self.entries[key]
+
+    def stats(self) -> str:
+        return f"hits: {self.hits}, misses: {self.misses}, entries: {len(self.entries)}"
+
+
 class MCPClient:
-    def __init__(self, mcp: Client):
-        self.client = mcp
+    def __init__(
+        self,
+        new_client,
+        concurrency: int | None = None,
+        namespace: str | None = None,
+        ttls: dict[str, float] | None = None,
+    ):
+        self.new_client = new_client
+        self.client = new_client()
         self.specs = None
+        self.limit = asyncio.Semaphore(concurrency) if concurrency else None
+        self.namespace = namespace
+        self.ttls = ttls or {}
+        self.restarting = asyncio.Lock()
+
+    def exposed_name(self, name: str) -> str:
+        return f"{self.namespace}__{name}" if self.namespace else name
 
     async def __aenter__(self):
         await self.client.__aenter__()
@@ -20,6 +82,18 @@ class MCPClient:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.client.__aexit__(exc_type, exc_val, exc_tb)
 
+    async def restart(self, broken):
+        async with self.restarting:
+            if self.client is not broken:
+                return
+            try:
+                await self.client.__aexit__(None, None, None)
+            except Exception:
+                pass
+            self.client = self.new_client()
+            self.specs = None
+            await self.client.__aenter__()
+
     async def list_tools(self):
         if self.specs is None:
             tools = await self.client.list_tools()
@@ -37,7 +111,11 @@ class MCPClient:
         return self.specs
 
     async def call_tool(self, name, params):
-        result = await self.client.call_tool(name, params, raise_on_error=False)
+        if self.limit is None:
+            result = await self.client.call_tool(name, params, raise_on_error=False)
+        else:
+            async with self.limit:
+                result = await self.client.call_tool(name, params, raise_on_error=False)
         if result.is_error:
             err = result.content[0].text
             return {"status": "error", "message": err}
@@ -66,15 +144,16 @@ class Call:
 
 
 class Calls:
-    def __init__(self, stream):
-        self.stream = stream
-        self.consumed = False
-        self.buffer = None
+    def __init__(self, buffer: dict):
+        self.buffer = buffer
 
     def __len__(self) -> int:
-        return len(self._consume())
+        return len(self.buffer)
 
     def __iter__(self):
+        # yaml takes a while to import and is only needed once the model calls a tool
+        import yaml
+
         for id, name, args in self._func_args():
             params = None
             try:
@@ -85,42 +164,83 @@ class Calls:
             yield Call(id, name, params)
 
     def __str__(self) -> str:
-        self._consume()
         return ";".join([f"{name}({args})" for _, name, args in self._func_args()])
 
     def _func_args(self):
-        for fn_call in self._consume().values():
+        for fn_call in self.buffer.values():
             yield (fn_call["id"], fn_call["fn"]["name"], fn_call["fn"]["args"])
 
-    def _consume(self):
-        if self.buffer is None:
-            buffer = {}
-            for tool in self.stream:
-                for t in tool:
-                    index = t.index
-                    if index not in buffer:
-                        buffer[index] = {
-                            "id": t.id,
-                            "fn": {"name": t.function.name, "args": ""},
-                        }
-                    if t.function.arguments:
-                        buffer[index]["fn"]["args"] += t.function.arguments
-            self.buffer = buffer
-        return self.buffer
-
 
 class Tools:
-    def __init__(self):
+    def __init__(self, concurrency: int = 8, cache_entries: int = 256):
         self.mcps: dict[str, MCPClient] = {}
+        self.limit = asyncio.Semaphore(concurrency)
+        self.cache = ToolCache(cache_entries)
+        self.index: dict[str, tuple[MCPClient, str, str]] = {}
+        # updated in place and passed with every request, so tool list changes
+        # apply from the next request on
+        self.definitions = [] + LocalTools.definitions
+        self.background = set()
 
-    async def add_mcp(self, cmd, args):
+    async def add_mcp(self, cmd, args, concurrency=None, namespace=None, cache=None):
         full_cmd = " ".join([cmd] + args)
-        if full_cmd in self.mcps.items():
+        if full_cmd in self.mcps:
             return
-        transport = StdioTransport(command=cmd, args=args)
-        mcp = MCPClient(Client(transport))
+        self.mcps[full_cmd] = await self._start(
+            cmd, args, concurrency, namespace, cache
+        )
+        errors = await self._reindex()
+        if full_cmd in errors:
+            await self._drop(full_cmd)
+            raise ValueError(errors[full_cmd])
+
+    async def add_mcps(self, tools: list[dict]):
+        tools = [t for t in tools if " ".join([t["cmd"]] + t["args"]) not in self.mcps]
+        started = await asyncio.gather(
+            *[
+                self._start(
+                    t["cmd"],
+                    t["args"],
+                    t.get("concurrency"),
+                    t.get("namespace"),
+                    t.get("cache"),
+                )
+                for t in tools
+            ],
+            return_exceptions=True,
+        )
+        for t, mcp in zip(tools, started):
+            if isinstance(mcp, BaseException):
+                print(f"Fail to start MCP '{t['name']}': {mcp}")
+            else:
+                self.mcps[" ".join([t["cmd"]] + t["args"])] = mcp
+        for full_cmd, error in (await self._reindex()).items():
+            await self._drop(full_cmd)
+            print(error)
+
+    async def _start(self, cmd, args, concurrency, namespace, cache) -> MCPClient:
+        # import off the event loop so the prompt stays responsive
+        await asyncio.to_thread(importlib.import_module, "fastmcp")
+        from fastmcp import Client
+        from fastmcp.client.transports import StdioTransport
+
+        full_cmd = " ".join([cmd] + args)
+        handler = tool_list_changed(lambda: self._tool_list_changed(full_cmd))
+        mcp = MCPClient(
+            lambda: Client(
+                StdioTransport(command=cmd, args=args), message_handler=handler
+            ),
+            concurrency,
+            namespace,
+            cache,
+        )
         await mcp.__aenter__()
-        self.mcps[full_cmd] = mcp
+        return mcp
+
+    async def _drop(self, full_cmd):
+        self.cache.drop(full_cmd)
+        mcp = self.mcps.pop(full_cmd)
+        await mcp.__aexit__(None, None, None)
 
     async def del_mcp(self, cmd, args):
         full_cmd = " ".join([cmd] + args)
@@ -128,19 +248,86 @@ class Tools:
         if mcp is None:
             return
         del self.mcps[full_cmd]
+        self.cache.drop(full_cmd)
         await mcp.__aexit__(None, None, None)
+        await self._reindex()
+
+    async def close(self):
+        for full_cmd in list(self.mcps):
+            await self._drop(full_cmd)
+
+    def _tool_list_changed(self, full_cmd):
+        mcp = self.mcps.get(full_cmd, None)
+        if mcp is None:
+            return
+        mcp.specs = None
+        self._in_background(self._reindex_and_report())
+
+    def _in_background(self, coro):
+        task = asyncio.create_task(coro)
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+
+    async def _reindex_and_report(self):
+        for error in (await self._reindex()).values():
+            print(error)
 
-    async def specs(self) -> list:
-        defs = [] + LocalTools.definitions
-        for _, mcp in self.mcps.items():
-            defs += await mcp.list_tools()
-        return defs
+    async def _reindex(self) -> dict[str, str]:
+        owners = {d["function"]["name"]: "local" for d in LocalTools.definitions}
+        index = {}
+        definitions = [] + LocalTools.definitions
+        errors = {}
+        for full_cmd, mcp in list(self.mcps.items()):
+            specs = await mcp.list_tools()
+            exposed = [mcp.exposed_name(s["function"]["name"]) for s in specs]
+            if clash := next((name for name in exposed if name in owners), None):
+                errors[full_cmd] = (
+                    f"Tool '{clash}' of '{full_cmd}' collides with "
+                    f"'{owners[clash]}', set a namespace for one of them"
+                )
+                continue
+            for spec, name in zip(specs, exposed):
+                owners[name] = full_cmd
+                index[name] = (mcp, spec["function"]["name"], full_cmd)
+                definitions.append(
+                    {"type": "function", "function": spec["function"] | {"name": name}}
+                )
+        self.index = index
+        self.definitions[:] = definitions
+        return errors
+
+    async def _restart(self, mcp: MCPClient, broken):
+        await mcp.restart(broken)
+        await self._reindex_and_report()
+
+    async def execute_all(self, calls: list[Call]) -> list[dict]:
+        return await asyncio.gather(*[self.execute(call) for call in calls])
 
     async def execute(self, call: Call) -> dict:
-        for _, mcp in self.mcps.items():
-            for mcp_tool in await mcp.list_tools():
-                if mcp_tool["function"]["name"] == call.fn:
-                    return await mcp.call_tool(call.fn, call.params)
+        async with self.limit:
+            with telemetry.timer("tool", call.fn) as values:
+                result = await self._execute(call)
+                values["errors"] = int(result.get("status") == "error")
+                return result
+
+    async def _execute(self, call: Call) -> dict:
+        if route := self.index.get(call.fn):
+            mcp, name, full_cmd = route
+            ttl = mcp.ttls.get(name)
+            if ttl:
+                key = self.cache.key(full_cmd, name, call.params)
+                if cached := self.cache.get(key):
+                    return cached
+            client = mcp.client
+            try:
+                result = await mcp.call_tool(name, call.params)
+            except Exception:
+                # tool errors come back as results, so this is a broken session
+                await self._restart(mcp, client)
+                result = await mcp.call_tool(name, call.params)
+            if ttl and result["status"] == "success":
+                self.cache.put(key, ttl, result)
+            return result
 
         method = getattr(LocalTools, call.fn)
         valid_params = inspect.signature(method).parameters.keys()